@@ -0,0 +1,60 @@
+"""
+Compares time of creating CPIC encodings (CpicEncodingsBuilder.result) from rows of CPIC database dump:
+    uncached: gene result is normalized again for each diplotype
+    cached:   normalization is memoized by encode_gene_result, cache is cleared before each repeat
+
+Usage: python benchmarks/cpic_encodings.py [path to cpic_db_dump.sql.gz] [repeats]
+
+Without path, dump is downloaded from CPIC_DEFAULT_URL to cache directory.
+"""
+import statistics
+import sys
+import time
+from functools import lru_cache
+
+from openpgx import cpic
+from openpgx.cpic import CPIC_DEFAULT_URL, CpicEncodingsBuilder, build_from_cpic_dump, encode_gene_result
+from openpgx.helpers import download_to_cache_dir
+
+
+class LoadedEncodingsBuilder(CpicEncodingsBuilder):
+    "Builder that only keeps rows, so result() can be measured separately from parsing of dump"
+
+    def result(self):
+        return self
+
+
+def measure(builder: CpicEncodingsBuilder, repeats: int) -> float:
+    times = []
+    for _ in range(repeats):
+        encode_gene_result.cache_clear()
+        start = time.perf_counter()
+        CpicEncodingsBuilder.result(builder)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def main():
+    sql_gz_path = sys.argv[1] if len(sys.argv) > 1 else download_to_cache_dir(CPIC_DEFAULT_URL)
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+
+    [builder] = build_from_cpic_dump(sql_gz_path, [LoadedEncodingsBuilder()], jobs=1)
+
+    cached = measure(builder, repeats)
+    hits, misses = builder.cache_hits, builder.cache_misses
+
+    # Cache of size 0 only counts calls
+    cpic.encode_gene_result = lru_cache(maxsize=0)(encode_gene_result.__wrapped__)
+    try:
+        uncached = measure(builder, repeats)
+    finally:
+        cpic.encode_gene_result = encode_gene_result
+
+    print(f"{len(builder.diplotypes)} diplotypes, cache hits: {hits}, misses: {misses}")
+    print(f"{'mode':<10} {'time s':>8}")
+    print(f"{'uncached':<10} {uncached:>8.3f}")
+    print(f"{'cached':<10} {cached:>8.3f}")
+
+
+if __name__ == "__main__":
+    main()
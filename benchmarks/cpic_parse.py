@@ -0,0 +1,63 @@
+"""
+Compares time and resident memory of parsing CPIC database dump during "openpgx update":
+    full:      every row of every table is loaded to dictionary (load_cpic_dump), then recommendations
+               and encodings are created from it
+    projected: only needed columns of needed tables are streamed to builders (build_from_cpic_dump with jobs=1)
+    parallel:  the same, but decompressed copy of dump is parsed by one process per CPU
+
+Usage: python benchmarks/cpic_parse.py [path to cpic_db_dump.sql.gz] [repeats]
+
+Without path, dump is downloaded from CPIC_DEFAULT_URL to cache directory.
+"""
+import statistics
+import subprocess
+import sys
+
+from openpgx.cpic import CPIC_DEFAULT_URL
+from openpgx.helpers import download_to_cache_dir
+
+MEASURE = """
+import resource, sys, time
+from openpgx.cpic import *
+baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+start = time.perf_counter()
+if sys.argv[2] == "full":
+    data = load_cpic_dump(sys.argv[1])
+    create_cpic_recommendations(data)
+    create_cpic_encodings(data)
+else:
+    jobs = 1 if sys.argv[2] == "projected" else None
+    build_from_cpic_dump(sys.argv[1], [CpicRecommendationsBuilder(), CpicEncodingsBuilder()], jobs)
+print(time.perf_counter() - start, (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseline) / 1024)
+"""
+
+
+def measure(mode: str, sql_gz_path: str, repeats: int) -> dict:
+    results = []
+    for _ in range(repeats):
+        output = subprocess.run(
+            [sys.executable, "-c", MEASURE, sql_gz_path, mode],
+            check=True,
+            capture_output=True,
+            text=True,
+        ).stdout
+        results.append([float(value) for value in output.split()])
+
+    return {
+        "time": statistics.median(result[0] for result in results),
+        "memory": statistics.median(result[1] for result in results),
+    }
+
+
+def main():
+    sql_gz_path = sys.argv[1] if len(sys.argv) > 1 else download_to_cache_dir(CPIC_DEFAULT_URL)
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+
+    print(f"{'mode':<10} {'time s':>8} {'RSS MB':>8}")
+    for mode in ["full", "projected", "parallel"]:
+        result = measure(mode, sql_gz_path, repeats)
+        print(f"{mode:<10} {result['time']:>8.2f} {result['memory']:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+Compares cold load time and resident memory of database.json and its binary snapshot (database.pickle).
+
+Usage: python benchmarks/database_load.py [path to database.json] [repeats]
+
+Every measurement runs in fresh interpreter, so it includes everything done on first get_database() call.
+"""
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+
+from openpgx.helpers import DATABASE_PATH, snapshot_path_for
+
+SAVE_SNAPSHOT = """
+import sys
+from openpgx.helpers import load_json, save_snapshot
+save_snapshot(sys.argv[2], load_json(sys.argv[1]))
+"""
+
+MEASURE = """
+import resource, sys, time
+from openpgx.helpers import load_json, load_snapshot
+from openpgx.index import compile_database
+baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+start = time.perf_counter()
+database = {loader}(sys.argv[1])
+loaded = time.perf_counter()
+compile_database(database)
+compiled = time.perf_counter()
+print(loaded - start, compiled - start, (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseline) / 1024)
+"""
+
+
+def measure(loader: str, database_path: str, repeats: int) -> dict:
+    results = []
+    for _ in range(repeats):
+        output = subprocess.run(
+            [sys.executable, "-c", MEASURE.format(loader=loader), database_path],
+            check=True,
+            capture_output=True,
+            text=True,
+        ).stdout
+        results.append([float(value) for value in output.split()])
+
+    return {
+        "load": statistics.median(result[0] for result in results),
+        "load_and_compile": statistics.median(result[1] for result in results),
+        "memory": statistics.median(result[2] for result in results),
+    }
+
+
+def main():
+    database_path = sys.argv[1] if len(sys.argv) > 1 else DATABASE_PATH
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+
+    with tempfile.TemporaryDirectory(prefix="openpgx") as tmpdirname:
+        json_path = os.path.join(tmpdirname, "database.json")
+        shutil.copy(database_path, json_path)
+        snapshot_path = snapshot_path_for(json_path)
+        # Snapshot is written in separate process, because peak memory is inherited by child processes
+        subprocess.run([sys.executable, "-c", SAVE_SNAPSHOT, json_path, snapshot_path], check=True)
+
+        print(f"{'format':<10} {'size MB':>8} {'load s':>8} {'+compile s':>11} {'RSS MB':>8}")
+        for name, loader, file_path in [
+            ("json", "load_json", json_path),
+            ("snapshot", "load_snapshot", snapshot_path),
+        ]:
+            result = measure(loader, file_path, repeats)
+            print(
+                f"{name:<10} {os.path.getsize(file_path) / 2**20:>8.1f} {result['load']:>8.3f}"
+                f" {result['load_and_compile']:>11.3f} {result['memory']:>8.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
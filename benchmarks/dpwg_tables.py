@@ -0,0 +1,67 @@
+"""
+Compares time of extracting tables of recommendations from DPWG guidelines with first_table_from_html
+and with BeautifulSoup (only if bs4 is installed, it is no longer a dependency of openpgx).
+
+Usage: python benchmarks/dpwg_tables.py [path to dosingGuidelines.json.zip] [repeats]
+
+Without path, archive is downloaded from DPWG_DEFAULT_URL to cache directory.
+"""
+import json
+import statistics
+import sys
+import time
+import zipfile
+from fnmatch import fnmatch
+
+from openpgx.dpwg import DPWG_DEFAULT_URL, DPWG_ENTRY_PATTERN
+from openpgx.helpers import download_to_cache_dir, first_table_from_html
+
+
+def bs4_first_table_from_html(html: str) -> list:
+    "Rows of the first table, as they were extracted before first_table_from_html"
+    import bs4
+
+    soup = bs4.BeautifulSoup(html, "html.parser")
+    for table in soup.find_all("table"):
+        return [["".join(cell.strings) for cell in tr.find_all(["td", "th"])] for tr in table.find_all("tr")]
+    return []
+
+
+def measure(extract, htmls: list, repeats: int) -> float:
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        for html in htmls:
+            extract(html)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def main():
+    zip_path = sys.argv[1] if len(sys.argv) > 1 else download_to_cache_dir(DPWG_DEFAULT_URL, extract=False)
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+
+    with zipfile.ZipFile(zip_path) as archive:
+        htmls = [
+            json.loads(archive.read(name))["guideline"]["textMarkdown"]["html"]
+            for name in archive.namelist()
+            if fnmatch(name.split("/")[-1], DPWG_ENTRY_PATTERN)
+        ]
+
+    extractors = [("html.parser", first_table_from_html)]
+    try:
+        import bs4  # noqa: F401
+
+        extractors.append(("bs4", bs4_first_table_from_html))
+        assert all(first_table_from_html(html) == bs4_first_table_from_html(html) for html in htmls)
+    except ImportError:
+        pass
+
+    print(f"{len(htmls)} guidelines")
+    print(f"{'extractor':<12} {'time s':>8}")
+    for name, extract in extractors:
+        print(f"{name:<12} {measure(extract, htmls, repeats):>8.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+"""
+Measures time of "import openpgx" with python -X importtime.
+
+Usage: python benchmarks/import_time.py [module] [repeats]
+
+Prints median cumulative import time of the module and modules that take most of it.
+"""
+import re
+import statistics
+import subprocess
+import sys
+from collections import defaultdict
+
+
+def import_times(module: str) -> dict:
+    """
+    Returns cumulative import time in microseconds of every module imported by "import <module>"
+    """
+    stderr = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stderr
+
+    result = {}
+    for line in stderr.splitlines():
+        match = re.match(r"import time:\s+(\d+) \|\s+(\d+) \|(\s+)(\S+)", line)
+        if match:
+            result[match.group(4)] = int(match.group(2))
+    return result
+
+
+def main():
+    module = sys.argv[1] if len(sys.argv) > 1 else "openpgx"
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+
+    times = defaultdict(list)
+    for _ in range(repeats):
+        for name, cumulative in import_times(module).items():
+            times[name].append(cumulative)
+
+    medians = {name: statistics.median(values) for name, values in times.items()}
+    print(f"import {module}: {medians[module] / 1000:.1f} ms (median of {repeats})")
+    print()
+    for name, cumulative in sorted(medians.items(), key=lambda item: -item[1])[1:16]:
+        print(f"{cumulative / 1000:>8.1f} ms  {name}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,23 +1,36 @@
 import os
-from pkgutil import get_data
-import re
-from collections import defaultdict
-from typing import Optional
-
-from loguru import logger
-from numpy import source
+import time
+from collections import defaultdict, deque
+from importlib import import_module
+from itertools import islice
+from typing import Iterable, Iterator, Optional
+
+from openpgx import helpers
+from openpgx.helpers import (
+    cache_path,
+    download_to_cache_dir,
+    get_database,
+    hash_paths,
+    load_snapshot,
+    logger,
+    save_snapshot,
+)
+from openpgx.index import SOURCES, compile_factor, create_phenotypes_lookup, find_matching_recommendations
+
+# Builders of source databases are imported only by "openpgx update", they are not needed to match genotypes
+DATABASES = {
+    "cpic": "openpgx.cpic:create_cpic_database",
+    "dpwg": "openpgx.dpwg:create_dpwg_database",
+    "fda": "openpgx.fda:create_fda_database",
+}
 
-from openpgx.cpic import create_cpic_database
-from openpgx.dpwg import create_dpwg_database
-from openpgx.fda import create_fda_database
+# Source databases built by previous "openpgx update" (see create_source_database)
+BUILD_CACHE_DIR = cache_path("build")
 
-from openpgx.helpers import words_to_sentence, get_database
 
-DATABASES = {
-    "cpic": create_cpic_database,
-    "dpwg": create_dpwg_database,
-    "fda": create_fda_database,
-}
+def get_database_builder(name: str):
+    module_name, function_name = DATABASES[name].split(":")
+    return getattr(import_module(module_name), function_name)
 
 
 def index_recommendations(all_recommendations: list) -> dict:
@@ -71,16 +84,8 @@ def does_encoding_match_factor(encoding: str, factor: str) -> bool:
                 return True
         return False
     
-    # activity score: "== 2.00" and ">= 2.00"
-    if '= ' in factor and type(encoding) != str:
-        factor_operator, factor_value = factor[0:2], factor[2:]
-        if factor_operator == "==":
-            return encoding == float(factor_value)
-        elif factor_operator == ">=":
-            return encoding >= float(factor_value)
-
-    # In factors other than activity score (phenotype, genotype)
-    return encoding == factor
+    # Factor strings are parsed to predicates only once, when database is loaded
+    return compile_factor(factor).matches(encoding)
 
 
 
@@ -162,37 +167,97 @@ def verify_vendor_database(data):
     recommendation_factor_names = [d["factors"] for d in data.values()]
 
 
-def create_database(sources: dict = {}):
+def create_source_database(name: str, url: Optional[str] = None, jobs: Optional[int] = None) -> dict:
+    """
+    Creates database of single source (cpic, dpwg, fda). Result is cached under .cache/build with key made
+    from hash of downloaded source file and hash of code of its builder, so if neither of them changed
+    since previous "openpgx update", source is not built again.
+
+    jobs: number of processes used by builder, by default number of CPUs
+    """
+    import glob
+    import hashlib
+
+    builder = get_database_builder(name)
+    builder_module = import_module(DATABASES[name].split(":")[0])
+    if url is None:
+        url = getattr(builder_module, f"{name.upper()}_DEFAULT_URL")
+
+    source_hash = hash_paths([download_to_cache_dir(url, extract=False)])
+    builder_hash = hash_paths([builder_module.__file__, helpers.__file__])
+    key = hashlib.sha256(f"{name}:{source_hash}:{builder_hash}".encode("utf-8")).hexdigest()[0:16]
+    build_path = os.path.join(BUILD_CACHE_DIR, f"{name}-{key}.pickle")
+
+    if os.path.exists(build_path):
+        logger.info("Source database not changed, using previous build", source=name, path=build_path)
+        return load_snapshot(build_path)
+
+    result = builder(url, jobs)
+
+    os.makedirs(BUILD_CACHE_DIR, exist_ok=True)
+    for previous_build_path in glob.glob(os.path.join(BUILD_CACHE_DIR, f"{name}-*.pickle")):
+        os.remove(previous_build_path)
+    save_snapshot(build_path, result)
+
+    return result
+
+
+def build_source_database(name: str, url: Optional[str] = None, jobs: Optional[int] = None) -> tuple:
+    "Runs create_source_database and returns its result with wall time in seconds"
+    start = time.perf_counter()
+    result = create_source_database(name, url, jobs)
+    return result, time.perf_counter() - start
+
+
+def create_database(sources: dict = {}, jobs: Optional[int] = None):
+    """
+    Creates database of all sources. Sources are built concurrently, each of them in separate process,
+    and their wall times are reported when all of them are done.
+
+    jobs: number of processes used by builder of each source, by default number of CPUs
+    """
+    from concurrent.futures import ProcessPoolExecutor
+
+    start = time.perf_counter()
     result = {}
+    wall_times = {}
 
-    for name in ["cpic", "dpwg", "fda"]:
-        result[name] = DATABASES[name](sources.get(name))
+    with ProcessPoolExecutor(len(SOURCES)) as executor:
+        futures = {name: executor.submit(build_source_database, name, sources.get(name), jobs) for name in SOURCES}
+        for name, future in futures.items():
+            result[name], wall_times[name] = future.result()
+
+    for name in SOURCES:
+        logger.info("Source database created", source=name, seconds=round(wall_times[name], 2))
+    logger.info("All source databases created", seconds=round(time.perf_counter() - start, 2))
+
+    result["phenotypes"] = create_phenotypes_lookup(result)
 
     return result
 
 
 def get_drugs(database) -> list:
     drugs = []
-    for source_database in database.values():
-        drugs.extend(source_database["recommendations"].keys())
+    for source in SOURCES:
+        drugs.extend(database[source]["recommendations"].keys())
     return drugs
 
 def phenotyping(genotypes: dict, database: dict ) -> dict:
     """
     Performs translation, changing genotype to encoding according to encodings taken from databases.
     genotype: according to main input example.json
-    database: dictionary with databases names as keys (cpic, fda, dpwg) and "recommendations" and "encodings"
+    database: dictionary with databases names as keys (cpic, fda, dpwg) and "recommendations" and "encodings",
+        and "phenotypes" lookup table merged from their encodings (see create_phenotypes_lookup)
     """
-    cpic_encodings = database["cpic"]["encodings"]
-    dpwg_encodings = database["dpwg"]["encodings"]
-    fda_encodings = database["fda"]["encodings"] #TODO implement encodings from DPWG and FDA also
+    phenotypes = database["phenotypes"] #TODO implement encodings from FDA also
     phenotyping_result = {}
     for gene, genotype in genotypes.items():
-        sorted_genotype = "/".join(sorted(genotype.split("/")))
-        phenotyping_result[gene] = []
-        for encodings in [cpic_encodings, dpwg_encodings]:
-            if gene in encodings and sorted_genotype in encodings[gene]:
-                phenotyping_result[gene] = encodings[gene][sorted_genotype]
+        gene_phenotypes = phenotypes.get(gene, {})
+        encodings = gene_phenotypes.get(genotype)
+        if encodings is None and genotype.count("/") > 1:
+            # Genotypes with more than two alleles are stored only with both orders of alleles
+            encodings = gene_phenotypes.get("/".join(sorted(genotype.split("/"))))
+        phenotyping_result[gene] = encodings if encodings is not None else []
     return phenotyping_result
     
     
@@ -212,24 +277,103 @@ def get_recommendations_for_patient(genotypes: dict) -> dict:
 
     genotype: dictionary with all genes that were genotyped for specific patient, according to example.json
     """
-    recommendations = defaultdict(dict)
-
     database = get_database()
 
-    drugs = get_drugs(database)
-    
     genotypes_translated_to_encodings = phenotyping(genotypes, database)
 
-    
-    for drug in drugs:
-        recommendations[drug] == defaultdict(list)
-        for source, source_database in database.items():
+    return get_recommendations_for_encodings(genotypes_translated_to_encodings, database)
+
+
+def get_recommendations_for_encodings(encodings: dict, database: dict) -> dict:
+    """
+    Creates recommendation dictionary for each drug in database for already phenotyped genotypes.
+    Only recommendations that reference genes from encodings are checked, using index of each source
+    database (see openpgx.index), so other recommendations are never touched.
+    """
+    recommendations = defaultdict(dict)
+
+    for drug in get_drugs(database):
+        for source in SOURCES:
             recommendations[drug][source] = []
-            recommendation = get_recommendation_for_drug(
-                source_database, drug, genotypes_translated_to_encodings
-            )
 
-            if recommendation != None:
-                recommendations[drug][source].append(recommendation)
+    for source in SOURCES:
+        matched_by_drug = defaultdict(list)
+        for drug, recommendation in find_matching_recommendations(database[source]["index"], encodings):
+            matched_by_drug[drug].append(recommendation)
+
+        for drug, matched_recommendations in matched_by_drug.items():
+            recommendations[drug][source].append(get_best_recommendation(matched_recommendations))
 
     return dict(recommendations)
+
+
+def get_phenotype_signature(encodings: dict) -> tuple:
+    """
+    Canonical, hashable representation of phenotyping result. Patients with the same signature
+    always get the same recommendations. Genes without encodings don't match any recommendation,
+    so they are not part of signature.
+    """
+    return tuple(
+        (gene, tuple(gene_encodings) if type(gene_encodings) == list else gene_encodings)
+        for gene, gene_encodings in sorted(encodings.items())
+        if gene_encodings != []
+    )
+
+
+def get_recommendations_for_patients(genotypes_list: list) -> list:
+    """
+    Batch version of get_recommendations_for_patient, returns recommendations in the same order as genotypes_list.
+
+    Patients are grouped by signature of their phenotyping result and recommendations are computed once
+    for each distinct signature. Patients with the same signature share the same result dictionary.
+    """
+    database = get_database()
+
+    recommendations_by_signature = {}
+    result = []
+
+    for genotypes in genotypes_list:
+        encodings = phenotyping(genotypes, database)
+        signature = get_phenotype_signature(encodings)
+
+        if signature not in recommendations_by_signature:
+            recommendations_by_signature[signature] = get_recommendations_for_encodings(encodings, database)
+
+        result.append(recommendations_by_signature[signature])
+
+    return result
+
+
+def yield_recommendations_for_patients(
+    genotypes_iterable: Iterable[dict], chunk_size: int = 1000, jobs: int = 1
+) -> Iterator[dict]:
+    """
+    Streaming version of get_recommendations_for_patients. Genotypes are consumed in chunks of chunk_size,
+    so only few chunks of patients are kept in memory at a time, no matter how large the cohort is.
+
+    If jobs is greater than 1, chunks are processed in pool of worker processes. Database is loaded
+    before pool is started, so workers inherit it (or load it once, if processes are not forked).
+    Recommendations are always yielded in the same order as genotypes.
+    """
+    genotypes_iterator = iter(genotypes_iterable)
+    chunks = iter(lambda: list(islice(genotypes_iterator, chunk_size)), [])
+
+    if jobs <= 1:
+        for chunk in chunks:
+            yield from get_recommendations_for_patients(chunk)
+        return
+
+    from multiprocessing import Pool
+
+    get_database()
+
+    with Pool(jobs, initializer=get_database) as pool:
+        # Keep limited number of chunks in flight, so input is not read ahead of output
+        pending = deque()
+        for chunk in chunks:
+            pending.append(pool.apply_async(get_recommendations_for_patients, (chunk,)))
+            if len(pending) >= 2 * jobs:
+                yield from pending.popleft().get()
+
+        while pending:
+            yield from pending.popleft().get()
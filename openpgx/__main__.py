@@ -1,13 +1,15 @@
 import sys
 from argparse import ArgumentParser
 
-from openpgx import create_database, get_recommendations_for_patient
+from openpgx import create_database, get_recommendations_for_patient, yield_recommendations_for_patients
 from openpgx.helpers import (
     load_json,
     save_json,
+    yield_jsonl,
+    save_jsonl,
     save_database,
     repository_path,
-    logger,
+    add_log_sink,
     extract_usage,
     with_logs,
     load_database,
@@ -15,16 +17,19 @@ from openpgx.helpers import (
 
 
 def main():
-    logger.add(
+    add_log_sink(
         sys.stderr, level="INFO", format="<level>{level: <8}</level> {message} {extra}"
     )
 
     parser = ArgumentParser(prog="openpgx")
     parser.add_argument("positional", nargs="*")
-    parser.add_argument("-o", "--output", default="recommendations.json")
+    parser.add_argument("-o", "--output")
     parser.add_argument("--cpic")
     parser.add_argument("--dpwg")
     parser.add_argument("--fda")
+    parser.add_argument("-j", "--jobs", type=int)
+    parser.add_argument("--sqlite", action="store_true")
+    parser.add_argument("--blocks", action="store_true")
     args = vars(parser.parse_args())
     
     if "positional" not in args or len(args["positional"]) == 0:
@@ -35,13 +40,31 @@ def main():
     command = args["positional"][0]
 
     if command == "update":
-        db = create_database(sources=args)
+        db = create_database(sources=args, jobs=args["jobs"])
         save_database(db)
 
+        if args["sqlite"]:
+            from openpgx.sqlite import save_sqlite_database
+
+            save_sqlite_database(db)
+
+        if args["blocks"]:
+            from openpgx.blocks import save_blocks_database
+
+            save_blocks_database(db)
+
+    elif command == "batch":
+        input_path = args["positional"][1] if len(args["positional"]) > 1 else "-"
+        genotypes = yield_jsonl(input_path)
+        save_jsonl(
+            args["output"] or "-",
+            yield_recommendations_for_patients(genotypes, jobs=args["jobs"] or 1),
+        )
+
     else:
         genotype = load_json(args["positional"][0])
         recommendations = get_recommendations_for_patient(genotype)
-        save_json(args["output"], recommendations)
+        save_json(args["output"] or "recommendations.json", recommendations)
 
 
 if __name__ == "__main__":
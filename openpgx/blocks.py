@@ -0,0 +1,140 @@
+"""
+Database layout where recommendations of each drug (and encodings of each gene) are separately addressable blocks.
+Offsets of all blocks are stored at the head of file, and file is read through mmap, so block is deserialized
+only when its drug or gene is queried for the first time.
+
+File format:
+    b"OPENPGX1", length of header (8 bytes, little endian), header (json), blocks (json)
+
+Header:
+    {"cpic": {"recommendations": {"abacavir": [offset, length], ...}, "encodings": {"CYP2D6": [offset, length]}},
+     ..., "phenotypes": {"CYP2D6": [offset, length], ...}}
+"""
+import json
+import mmap
+import os
+from collections.abc import Mapping
+
+from openpgx import get_recommendation_for_drug, phenotyping
+from openpgx.helpers import repository_path
+from openpgx.index import SOURCES, create_phenotypes_lookup
+
+BLOCKS_DATABASE_PATH = repository_path("database.blocks")
+MAGIC = b"OPENPGX1"
+
+
+class LazyBlocks(Mapping):
+    """
+    Read-only dictionary whose values are deserialized from blocks of mmaped file on first access
+    """
+
+    def __init__(self, buffer: mmap.mmap, offsets: dict):
+        self.buffer = buffer
+        self.offsets = offsets
+        self.loaded = {}
+
+    def __getitem__(self, key):
+        if key not in self.loaded:
+            offset, length = self.offsets[key]
+            self.loaded[key] = json.loads(self.buffer[offset : offset + length])
+        return self.loaded[key]
+
+    def __contains__(self, key) -> bool:
+        return key in self.offsets
+
+    def __iter__(self):
+        return iter(self.offsets)
+
+    def __len__(self) -> int:
+        return len(self.offsets)
+
+
+def save_blocks_database(database: dict, blocks_path: str = BLOCKS_DATABASE_PATH):
+    """
+    Writes database created by create_database in blocks layout
+    """
+    blocks = []
+    size = 0
+
+    def add_blocks(values: dict) -> dict:
+        nonlocal size
+        offsets = {}
+        for key, value in values.items():
+            block = json.dumps(value).encode("utf-8")
+            offsets[key] = [size, len(block)]
+            blocks.append(block)
+            size += len(block)
+        return offsets
+
+    header = {
+        source: {key: add_blocks(database[source][key]) for key in ["recommendations", "encodings"]}
+        for source in SOURCES
+    }
+    header["phenotypes"] = add_blocks(database.get("phenotypes") or create_phenotypes_lookup(database))
+    encoded_header = json.dumps(header).encode("utf-8")
+
+    # Offsets in header are relative to the end of header. Running processes may have previous file mapped
+    # to memory, so it is replaced, not overwritten.
+    temporary_path = blocks_path + ".tmp"
+    with open(temporary_path, "wb") as f:
+        f.write(MAGIC)
+        f.write(len(encoded_header).to_bytes(8, "little"))
+        f.write(encoded_header)
+        for block in blocks:
+            f.write(block)
+    os.replace(temporary_path, blocks_path)
+
+
+class OffsetBuffer:
+    """
+    View of mmap starting at given offset, so offsets from header can be used directly
+    """
+
+    def __init__(self, buffer: mmap.mmap, offset: int):
+        self.buffer = buffer
+        self.offset = offset
+
+    def __getitem__(self, key: slice) -> bytes:
+        return self.buffer[key.start + self.offset : key.stop + self.offset]
+
+
+def load_blocks_database(blocks_path: str = BLOCKS_DATABASE_PATH) -> dict:
+    """
+    Opens database in blocks layout. Only header is read here, recommendations and encodings
+    are read when used for the first time. Result can be used in place of database in
+    get_recommendation_for_drug, phenotyping and get_drugs.
+    """
+    with open(blocks_path, "rb") as f:
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    if buffer[0 : len(MAGIC)] != MAGIC:
+        raise Exception(f"Not an openpgx blocks database: {blocks_path}")
+
+    header_length = int.from_bytes(buffer[len(MAGIC) : len(MAGIC) + 8], "little")
+    header_offset = len(MAGIC) + 8
+    header = json.loads(buffer[header_offset : header_offset + header_length])
+    blocks = OffsetBuffer(buffer, header_offset + header_length)
+
+    database = {
+        source: {key: LazyBlocks(blocks, offsets) for key, offsets in header[source].items()} for source in SOURCES
+    }
+    database["phenotypes"] = LazyBlocks(blocks, header["phenotypes"])
+
+    return database
+
+
+def get_recommendations_for_drugs(genotypes: dict, drugs: list, database: dict) -> dict:
+    """
+    The same as get_recommendations_for_patient, but only for given drugs, so only their
+    recommendations (and encodings of genotyped genes) are read from database.
+    """
+    encodings = phenotyping(genotypes, database)
+    recommendations = {}
+
+    for drug in drugs:
+        recommendations[drug] = {}
+        for source in SOURCES:
+            recommendation = get_recommendation_for_drug(database[source], drug, encodings)
+            recommendations[drug][source] = [recommendation] if recommendation is not None else []
+
+    return recommendations
@@ -1,15 +1,21 @@
 import csv
 import gzip
+import io
 import json
+import mmap
+import os
 import re
-from collections import defaultdict
-from typing import Optional, Any
+import shutil
+from collections import defaultdict, namedtuple
+from functools import lru_cache
+from typing import Any, Iterable, Iterator, Optional
 
 from openpgx.cpic import *
 from openpgx.helpers import (
     index_items_by_key,
     normalize_hla_gene_and_factor,
     download_to_cache_dir,
+    logger,
 )
 
 CPIC_DEFAULT_URL = "https://github.com/cpicpgx/cpic-data/releases/download/v1.15.1/cpic_db_dump-v1.15.1.sql.gz"
@@ -56,22 +62,27 @@ def normalize_cpic_factors(factors: dict) -> dict:
     return result
 
 
+def normalize_value(value: Optional[str]) -> Any:
+    "Converts value of column in cpic database dump to python value"
+    if value is None or value == "\\N":
+        return None
+    if value == "f":
+        return False
+    if value == "t":
+        return True
+    if value[0:1] == "{":
+        try:
+            return json.loads(value)
+        except json.JSONDecodeError:
+            # We don't need sets like {"asdfa sdfgs","asdfas asdfa"}
+            return None
+    return value
+
+
 # normalizes record from cpic database dump
 def normalize(table: str, record: dict) -> Optional[dict]:
     for key, value in record.items():
-        if value is not None:
-            if value == "\\N":
-                record[key] = None
-            elif value == "f":
-                record[key] = False
-            elif value == "t":
-                record[key] = True
-            elif value[0:1] == "{":
-                try:
-                    record[key] = json.loads(value)
-                except json.JSONDecodeError:
-                    # We don't need sets like {"asdfa sdfgs","asdfas asdfa"}
-                    record[key] = None
+        record[key] = normalize_value(value)
 
     if table == "recommendation":
         if record["drugrecommendation"] == "No recommendation":
@@ -82,6 +93,18 @@ def normalize(table: str, record: dict) -> Optional[dict]:
     return record
 
 
+def normalize_projected(table: str, row: tuple) -> Optional[tuple]:
+    "The same as normalize, but for row with only some of columns (see yield_projected_rows_from_sql_file)"
+    if table == "recommendation":
+        if getattr(row, "drugrecommendation", None) == "No recommendation":
+            return None
+
+        if "lookupkey" in row._fields:
+            row = row._replace(lookupkey=normalize_cpic_factors(row.lookupkey or {}))
+
+    return row
+
+
 def parse_copy(sql: str) -> dict:
     table_name, columns = re.search(
         r"COPY\s+(?:(?:[^(\.]+)\.)?([^(\.]+)\s+\(([^)]+)\)\s+FROM\s+stdin", sql
@@ -91,28 +114,125 @@ def parse_copy(sql: str) -> dict:
     return table_name, column_names
 
 
-def yield_rows_from_sql_file(sql_file: any):
-    table, columns, lines, reading = None, None, [], False
+def yield_copy_lines(lines: Iterator[str]) -> Iterator[str]:
+    "Yields lines of COPY block, up to its \\. terminator"
+    for line in lines:
+        if line[0:2] == "\\.":
+            return
+        yield line
 
-    for line in sql_file:
-        if re.match("\s*COPY", line):
-            table, columns = parse_copy(line)
-            reading = True
+
+def yield_rows_from_sql_file(sql_file: Iterable[str]):
+    """
+    Yields (table, record) for every row of every COPY block in sql file. Rows are read from file
+    one by one, so nothing but the current row is kept in memory.
+    """
+    lines = iter(sql_file)
+
+    for line in lines:
+        if not re.match(r"\s*COPY", line):
             continue
 
-        if line[0:2] == "\\.":
-            reading = False
-            reader = csv.DictReader(lines, fieldnames=columns, dialect="excel-tab")
-            for record in reader:
-                record = normalize(table, record)
-                if record is not None:
-                    yield table, record
-
-            lines = []
+        table, columns = parse_copy(line)
+
+        for record in csv.DictReader(yield_copy_lines(lines), fieldnames=columns, dialect="excel-tab"):
+            record = normalize(table, record)
+            if record is not None:
+                yield table, record
+
+
+def create_row_types(columns: dict) -> dict:
+    """
+    Creates namedtuple for rows of every table, for example {"drug": ["drugid", "name"]} => {"drug": drug(drugid, name)}
+    """
+    return {table: namedtuple(table, table_columns) for table, table_columns in columns.items()}
+
+
+def yield_projected_rows_from_sql_file(sql_file: Iterable[str], columns: dict) -> Iterator[tuple]:
+    """
+    Yields (table, row) for every row of tables in sql file, where row is namedtuple with values
+    of only given columns, for example:
+        columns: {"drug": ["drugid", "name"]}
+        => ("drug", drug(drugid="RxNorm:2670", name="codeine")), ...
+
+    Lines of other tables are skipped without parsing them, and other columns are not normalized.
+    """
+    lines = iter(sql_file)
+    row_types = create_row_types(columns)
+
+    for line in lines:
+        if not re.match(r"\s*COPY", line):
             continue
 
-        if reading:
-            lines.append(line)
+        table, copy_columns = parse_copy(line)
+
+        if table not in row_types:
+            for copy_line in lines:
+                if copy_line[0:2] == "\\.":
+                    break
+            continue
+
+        for row in parse_copy_lines(table, copy_columns, row_types[table], yield_copy_lines(lines)):
+            yield table, row
+
+
+def parse_copy_lines(table: str, copy_columns: list, row_type: type, lines: Iterable[str]) -> Iterator[tuple]:
+    "Parses lines of COPY block to rows of row_type (see yield_projected_rows_from_sql_file)"
+    positions = [copy_columns.index(column) for column in row_type._fields]
+
+    for values in csv.reader(lines, dialect="excel-tab"):
+        # The same as csv.DictReader, empty lines are skipped and missing values are None
+        if not values:
+            continue
+
+        row = row_type._make(
+            normalize_value(values[position]) if position < len(values) else None for position in positions
+        )
+        row = normalize_projected(table, row)
+        if row is not None:
+            yield row
+
+
+def merge_columns(builders: list) -> dict:
+    "Returns all columns of every table needed by builders"
+    columns = defaultdict(list)
+    for builder in builders:
+        for table, table_columns in builder.columns.items():
+            columns[table].extend(column for column in table_columns if column not in columns[table])
+    return dict(columns)
+
+
+def consume_cpic_rows(rows: Iterable[tuple], builders: list) -> list:
+    """
+    Passes every (table, row) to builders interested in its table and returns results of builders.
+
+    builder is an object with:
+        columns: names of tables it needs with names of their columns, for example {"drug": ["drugid", "name"]}
+        add(table, row): called for every row of these tables, in order of sql file,
+            row is namedtuple with (at least) these columns
+        result(): called when all rows were added
+    """
+    builders_by_table = defaultdict(list)
+    for builder in builders:
+        for table in builder.columns:
+            builders_by_table[table].append(builder)
+
+    for table, row in rows:
+        for builder in builders_by_table.get(table, ()):
+            builder.add(table, row)
+
+    return [builder.result() for builder in builders]
+
+
+def yield_rows_from_data(data: dict, columns: dict) -> Iterator[tuple]:
+    "Yields (table, row) rows of data loaded by load_cpic_dump, with only given columns"
+    row_types = create_row_types(columns)
+    for table, records in data.items():
+        if table not in row_types:
+            continue
+        row_type = row_types[table]
+        for record in records:
+            yield table, row_type._make(record[column] for column in row_type._fields)
 
 
 def load_cpic_database_from_descriptor(file) -> dict:
@@ -130,6 +250,115 @@ def load_cpic_dump(sql_gz_path) -> dict:
         return load_cpic_database_from_descriptor(file)
 
 
+# Size of chunks of COPY blocks parsed in parallel
+CHUNK_SIZE = 4 * 2**20
+
+
+def decompress_to_cache(sql_gz_path: str) -> str:
+    """
+    Returns path of decompressed copy of gzipped dump, stored next to it. Copy is created only
+    if it does not exist yet or is older than the dump.
+    """
+    sql_path = sql_gz_path[:-3] if sql_gz_path.endswith(".gz") else sql_gz_path + ".sql"
+
+    if not os.path.exists(sql_path) or os.path.getmtime(sql_path) < os.path.getmtime(sql_gz_path):
+        temporary_path = sql_path + ".tmp"
+        with gzip.open(sql_gz_path, "rb") as source, open(temporary_path, "wb") as target:
+            shutil.copyfileobj(source, target, 2**20)
+        os.replace(temporary_path, sql_path)
+
+    return sql_path
+
+
+def find_copy_chunks(buffer: mmap.mmap, columns: dict, chunk_size: int = CHUNK_SIZE) -> list:
+    """
+    Finds COPY blocks of tables in columns and returns them as (table, copy columns, start, end) byte ranges.
+    Blocks larger than chunk_size are split at line boundaries into several chunks, which is safe
+    because values in COPY blocks have their new lines escaped.
+    """
+    chunks = []
+    end = 0
+
+    for match in re.finditer(rb"^[ \t]*COPY[^\n]*\n", buffer, re.MULTILINE):
+        # Line starting with COPY inside of previous block is its value
+        if match.start() < end:
+            continue
+
+        table, copy_columns = parse_copy(match.group().decode("utf-8"))
+        start = match.end()
+        end = buffer.find(b"\n\\.", start - 1) + 1
+        if end == 0:
+            end = len(buffer)
+
+        if table not in columns:
+            continue
+
+        while end - start > chunk_size:
+            split = buffer.find(b"\n", start + chunk_size, end) + 1
+            if split == 0:
+                break
+            chunks.append((table, copy_columns, start, split))
+            start = split
+
+        if start < end:
+            chunks.append((table, copy_columns, start, end))
+
+    return chunks
+
+
+def parse_copy_chunk(sql_path: str, columns: dict, chunk: tuple) -> list:
+    "Parses chunk of COPY block found by find_copy_chunks, rows are returned as plain tuples"
+    table, copy_columns, start, end = chunk
+    row_type = create_row_types({table: columns[table]})[table]
+
+    with open(sql_path, "rb") as file:
+        file.seek(start)
+        # New lines are translated the same way as in gzip.open(..., "rt")
+        lines = io.StringIO(file.read(end - start).decode("utf-8"), newline=None)
+
+    return [tuple(row) for row in parse_copy_lines(table, copy_columns, row_type, lines)]
+
+
+def yield_rows_from_sql_file_in_parallel(sql_path: str, columns: dict, jobs: int) -> Iterator[tuple]:
+    """
+    The same as yield_projected_rows_from_sql_file, but COPY blocks of (decompressed) dump
+    are parsed in parallel by pool of jobs processes. Rows are yielded in order of file.
+    """
+    from functools import partial
+    from multiprocessing import Pool
+
+    with open(sql_path, "rb") as file:
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            chunks = find_copy_chunks(buffer, columns)
+
+    row_types = create_row_types(columns)
+
+    with Pool(jobs) as pool:
+        for chunk, rows in zip(chunks, pool.imap(partial(parse_copy_chunk, sql_path, columns), chunks)):
+            row_type = row_types[chunk[0]]
+            for row in rows:
+                yield chunk[0], row_type._make(row)
+
+
+def build_from_cpic_dump(sql_gz_path, builders: list, jobs: Optional[int] = None) -> list:
+    """
+    Streams rows of tables needed by builders from gzipped cpic database dump (see consume_cpic_rows)
+
+    jobs: number of processes parsing dump, by default number of CPUs. With more than one,
+        dump is decompressed to cache first (see decompress_to_cache).
+    """
+    columns = merge_columns(builders)
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+
+    if jobs > 1:
+        rows = yield_rows_from_sql_file_in_parallel(decompress_to_cache(sql_gz_path), columns, jobs)
+        return consume_cpic_rows(rows, builders)
+
+    with gzip.open(sql_gz_path, "rt") as file:
+        return consume_cpic_rows(yield_projected_rows_from_sql_file(file, columns), builders)
+
+
 def get_alleles(allele_table: list) -> dict:
     alleles = defaultdict(list)
     for raw in allele_table:
@@ -172,35 +401,140 @@ def normalize_phenotype(phenotype: str) -> str:
     return phenotype.lower()
     
 
-def create_cpic_encodings(data) -> dict:
-    result = defaultdict(lambda: defaultdict(list))
+@lru_cache(maxsize=4096)
+def encode_gene_result(genename: str, gene_result: str, activityscore: Optional[str]) -> tuple:
+    """
+    Returns normalized gene name and encodings of gene result, the same for every diplotype with this result:
+        ("CYP2D6", "Possible Poor Metabolizer", "0.5") => ("CYP2D6", ("possible poor metabolizer", "poor metabolizer", 0.5))
+    Encodings are tuple, so result cached by lru_cache can not be modified.
+    """
+    # First, encoding can be a phenotype name or genotype (mainly in case of HLA)
+    normalized_genename, factor = normalize_cpic_factor(genename, gene_result)
+    encodings = [factor]
+
+    # Later add normalized name for phenotype, to be compatible with other databases
+    normalized = normalize_phenotype(factor)
+    if normalized != factor:
+        encodings.append(normalized)  # Do not duplicate foactor
+
+    # Then optionally gene can be represented by an activity score
+    activityscore = normalize_activityscore(activityscore, False)
+    if activityscore is not None:
+        encodings.append(activityscore)
 
-    indexed_gene_result_lookup = index_items_by_key(data["gene_result_lookup"], "id")
-    indexed_gene_result = index_items_by_key(data["gene_result"], "id")
+    return normalized_genename, tuple(encodings)
 
-    for diplotype_row in data["gene_result_diplotype"]:
-        diplotype = "/".join(sorted(diplotype_row["diplotype"].split("/")))
-        phenotypes = indexed_gene_result_lookup[diplotype_row["functionphenotypeid"]]
-        gene_result = indexed_gene_result[phenotypes[0]["phenotypeid"]][0]
-        genename = normalize_genename(gene_result["genesymbol"], diplotype)
 
-        # First, encoding can be a phenotype name or genotype (mainly in case of HLA)
-        normalized_genename, factor = normalize_cpic_factor(
-            genename, gene_result["result"]
+class CpicEncodingsBuilder:
+    """
+    Creates encodings of genotypes (see create_cpic_encodings) from rows of gene_result,
+    gene_result_diplotype and gene_result_lookup tables.
+
+    In dump gene_result_diplotype comes before gene_result_lookup, so diplotypes are kept
+    until result() as pairs of diplotype and id of its lookup.
+    """
+
+    columns = {
+        "gene_result": ["id", "genesymbol", "result", "activityscore"],
+        "gene_result_diplotype": ["diplotype", "functionphenotypeid"],
+        "gene_result_lookup": ["id", "phenotypeid"],
+    }
+
+    def __init__(self):
+        self.gene_results = {}
+        self.phenotype_ids = {}
+        self.lookup_ids = {}
+        self.diplotypes = []
+        self.diplotype_lookup_ids = []
+        # Hits and misses of encode_gene_result cache during result()
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def add(self, table: str, row: tuple):
+        if table == "gene_result":
+            self.gene_results.setdefault(row.id, (row.genesymbol, row.result, row.activityscore))
+        elif table == "gene_result_lookup":
+            self.phenotype_ids.setdefault(row.id, row.phenotypeid)
+        elif table == "gene_result_diplotype":
+            lookup_id = row.functionphenotypeid
+            self.diplotypes.append(row.diplotype)
+            self.diplotype_lookup_ids.append(self.lookup_ids.setdefault(lookup_id, lookup_id))
+
+    def result(self) -> dict:
+        result = defaultdict(lambda: defaultdict(list))
+        cache_info = encode_gene_result.cache_info()
+
+        for diplotype, lookup_id in zip(self.diplotypes, self.diplotype_lookup_ids):
+            diplotype = "/".join(sorted(diplotype.split("/")))
+            genesymbol, gene_result, activityscore = self.gene_results[self.phenotype_ids[lookup_id]]
+            # Name of HLA gene depends on diplotype, so it is normalized before looking up encodings
+            genename = normalize_genename(genesymbol, diplotype)
+            normalized_genename, encodings = encode_gene_result(genename, gene_result, activityscore)
+            result[normalized_genename][diplotype].extend(encodings)
+
+        self.cache_hits = encode_gene_result.cache_info().hits - cache_info.hits
+        self.cache_misses = encode_gene_result.cache_info().misses - cache_info.misses
+        logger.debug(
+            "CPIC encodings created",
+            diplotypes=len(self.diplotypes),
+            cache_hits=self.cache_hits,
+            cache_misses=self.cache_misses,
         )
-        result[normalized_genename][diplotype].append(factor)
-        
-        # Later add normalized name for phenotype, to be compatible with other databases
-        normalized = normalize_phenotype(factor)
-        if normalized != factor:
-            result[normalized_genename][diplotype].append(normalize_phenotype(factor)) # Do not duplicate foactor
 
-        # Then optionally gene can be represented by an activity score
-        activityscore = normalize_activityscore(gene_result["activityscore"], False)
-        if activityscore is not None:
-            result[normalized_genename][diplotype].append(activityscore)
+        return {k: dict(v) for k, v in result.items()}
+
 
-    return {k: dict(v) for k, v in result.items()}
+class CpicRecommendationsBuilder:
+    """
+    Creates recommendations for every drug (see create_cpic_recommendations) from rows of
+    drug, guideline and recommendation tables.
+    """
+
+    columns = {
+        "drug": ["drugid", "name"],
+        "guideline": ["id", "url"],
+        "recommendation": ["drugid", "guidelineid", "lookupkey", "drugrecommendation", "classification"],
+    }
+
+    def __init__(self):
+        self.drug_names = {}
+        self.guideline_urls = {}
+        self.recommendations = []
+
+    def add(self, table: str, row: tuple):
+        if table == "drug":
+            self.drug_names.setdefault(row.drugid, row.name)
+        elif table == "guideline":
+            self.guideline_urls.setdefault(row.id, row.url)
+        elif table == "recommendation":
+            factors = row.lookupkey
+            # factors["population"] = row.population
+
+            self.recommendations.append(
+                (
+                    row.drugid,
+                    row.guidelineid,
+                    {
+                        "factors": factors,
+                        "recommendation": row.drugrecommendation,
+                        "strength": row.classification.lower(),
+                    },
+                )
+            )
+
+    def result(self) -> dict:
+        recommendations = defaultdict(list)
+        for drug_id, guideline_id, recommendation in self.recommendations:
+            recommendations[self.drug_names[drug_id]].append(
+                {**recommendation, "guideline": self.guideline_urls[guideline_id]}
+            )
+
+        return dict(recommendations)
+
+
+def create_cpic_encodings(data) -> dict:
+    builder = CpicEncodingsBuilder()
+    return consume_cpic_rows(yield_rows_from_data(data, builder.columns), [builder])[0]
 
 
 def create_cpic_recommendations(data: dict) -> dict:
@@ -209,36 +543,17 @@ def create_cpic_recommendations(data: dict) -> dict:
     data:
         authomaticly created dictionary from sql file. Each key corresponds to sql table name
     """
-    guideline_indexed_by_id = index_items_by_key(data["guideline"], "id")
-    drug_indexed_by_id = index_items_by_key(data["drug"], "drugid")
-
-    recommendations = defaultdict(list)
-    for raw in data["recommendation"]:
-        drug_name = drug_indexed_by_id[raw["drugid"]][0]["name"]
-        drug_recommendations = recommendations[drug_name]
-
-        factors = raw["lookupkey"]
-        # factors["population"] = raw["population"]
-
-        drug_recommendations.append(
-            {
-                "factors": factors,
-                "recommendation": raw["drugrecommendation"],
-                "strength": raw["classification"].lower(),
-                "guideline": guideline_indexed_by_id[raw["guidelineid"]][0]["url"],
-            }
-        )
-
-    return dict(recommendations)
+    builder = CpicRecommendationsBuilder()
+    return consume_cpic_rows(yield_rows_from_data(data, builder.columns), [builder])[0]
 
 
-def create_cpic_database(url: Optional[str] = None) -> dict:
+def create_cpic_database(url: Optional[str] = None, jobs: Optional[int] = None) -> dict:
     if url is None:
         url = CPIC_DEFAULT_URL
 
     cached_sql_gz = download_to_cache_dir(url)
-    data = load_cpic_dump(cached_sql_gz)
-    recommendations = create_cpic_recommendations(data)
-    encodings = create_cpic_encodings(data)
+    recommendations, encodings = build_from_cpic_dump(
+        cached_sql_gz, [CpicRecommendationsBuilder(), CpicEncodingsBuilder()], jobs
+    )
 
     return {"recommendations": recommendations, "encodings": encodings}
@@ -79,7 +79,8 @@ def subgroups_to_factors(subgroups: str) -> list:
 FDA_DEFAULT_URL = "https://raw.githubusercontent.com/PharmGKB/fda-biomarker/master/fda_pgx_associations_table.json"
 
 
-def create_fda_database(url: Optional[str] = None) -> dict:
+def create_fda_database(url: Optional[str] = None, jobs: Optional[int] = None) -> dict:
+    # FDA table is a single small json file, so it is always read by one process (jobs is not used)
     if url is None:
         url = FDA_DEFAULT_URL
 
@@ -1,20 +1,21 @@
 import json
 import os
+import pickle
 import re
-import tempfile
+import sys
+import threading
+import time
 import traceback
-import zipfile
 from collections import defaultdict
+from contextvars import ContextVar
 from os import path
 from pathlib import Path
-from typing import Any, Tuple
+from typing import Any, Iterable, Iterator, Optional, Tuple
 from urllib.parse import urlparse
-from urllib.request import Request, urlopen
 from io import StringIO
 from html.parser import HTMLParser
 
-from loguru import logger
-from termcolor import colored
+from openpgx.index import compile_database
 
 
 def repository_path(path: str) -> str:
@@ -26,12 +27,7 @@ DATABASE = None
 
 
 def get_database():
-    global DATABASE
-
-    if DATABASE is None:
-        load_database()
-
-    return DATABASE
+    return DATABASE_HANDLE.get()
 
 
 def load_json(json_path: str) -> dict:
@@ -39,27 +35,216 @@ def load_json(json_path: str) -> dict:
         return json.load(f)
 
 
-def load_database(database_path: str = DATABASE_PATH):
+def snapshot_path_for(database_path: str) -> str:
+    return path.splitext(database_path)[0] + ".pickle"
+
+
+def read_database(database_path: str = DATABASE_PATH) -> dict:
     """
-    Loads database from json (database.json) if exists already in repository.
+    Reads database from json (database.json) if exists already in repository,
+    and compiles recommendations index used for matching.
+
+    If binary snapshot of database (database.pickle) exists and was created from the same json, it is read
+    instead of json. Snapshot that can not be read (for example without permission to read it) is skipped.
     """
-    
-    global DATABASE
+    snapshot_path = snapshot_path_for(database_path)
+
+    if path.exists(snapshot_path):
+        try:
+            # Snapshot stores hash of json, because times of files are not preserved by every way of copying them
+            database_hash = hash_paths([database_path]) if path.exists(database_path) else None
+            return compile_database(load_snapshot(snapshot_path, database_hash))
+        except Exception as e:
+            if not path.exists(database_path):
+                raise
+            logger.warning("Could not use database snapshot, reading json", path=snapshot_path, error=str(e))
+
     if not os.path.exists(database_path):
         logger.error('No database present. Please use "openpgx update".')
 
-    DATABASE = load_json(database_path)
+    return compile_database(load_json(database_path))
+
+
+def load_database(database_path: str = DATABASE_PATH):
+    """
+    Loads database (see read_database) and makes it the one returned by get_database
+    """
+    global DATABASE
+
+    DATABASE = DATABASE_HANDLE.load(database_path)
     return DATABASE
 
 
+class DatabaseHandle:
+    """
+    Database loaded once, even if requested concurrently from many threads. Every check_interval seconds
+    handle checks if database.json was changed (for example by "openpgx update"), and one of threads loads
+    and compiles it again. Meanwhile, and until it is swapped in, other threads get previous database.
+    """
+
+    def __init__(self, database_path: str = DATABASE_PATH, check_interval: float = 1.0):
+        self.database_path = database_path
+        self.check_interval = check_interval
+        self.lock = threading.Lock()
+        self.reload_lock = threading.Lock()
+        self.database = None
+        self.version = None
+        self.checked_at = None
+
+    def get_version(self) -> Optional[tuple]:
+        # Only json is watched, save_database writes snapshot before json is replaced
+        try:
+            stat = os.stat(self.database_path)
+            return stat.st_mtime_ns, stat.st_size
+        except FileNotFoundError:
+            return None
+
+    def load(self, database_path: str = None) -> dict:
+        with self.lock:
+            if database_path is not None:
+                self.database_path = database_path
+            self.reload()
+            return self.database
+
+    def reload(self):
+        version = self.get_version()
+        database = read_database(self.database_path)
+        self.database, self.version, self.checked_at = database, version, time.monotonic()
+
+    def get(self) -> dict:
+        database = self.database
+        if database is not None and time.monotonic() - self.checked_at < self.check_interval:
+            return database
+
+        # Only the first load blocks callers
+        if database is None:
+            with self.lock:
+                if self.database is None:
+                    self.reload()
+                return self.database
+
+        if self.reload_lock.acquire(blocking=False):
+            try:
+                if time.monotonic() - self.checked_at >= self.check_interval:
+                    self.checked_at = time.monotonic()
+                    if self.get_version() != self.version:
+                        self.reload()
+            except Exception as e:
+                logger.warning("Could not reload database", path=self.database_path, error=str(e))
+            finally:
+                self.reload_lock.release()
+
+        return self.database
+
+
+DATABASE_HANDLE = DatabaseHandle()
+
+
+def intern_strings(data: Any, lists: dict = None) -> Any:
+    """
+    Returns copy of data where equal strings are the same object, and so are equal lists of strings and numbers
+    (for example recommendation texts and encodings). Pickle writes each of such objects only once.
+    """
+    if lists is None:
+        lists = {}
+
+    if type(data) == str:
+        return sys.intern(data)
+
+    if type(data) == dict:
+        return {sys.intern(key): intern_strings(value, lists) for key, value in data.items()}
+
+    if type(data) == list:
+        result = [intern_strings(item, lists) for item in data]
+        if all(type(item) in [str, int, float, bool] or item is None for item in result):
+            key = tuple((type(item), item) for item in result)
+            return lists.setdefault(key, result)
+        return result
+
+    return data
+
+
+def save_snapshot(snapshot_path: str, data: dict, source_hash: Optional[str] = None):
+    """
+    Writes data to binary snapshot, preceded by hash of file data was read from (see load_snapshot)
+    """
+    # Written with open, so snapshot gets the same permissions as database.json and is readable by other users
+    temporary_path = snapshot_path + ".tmp"
+    with open(temporary_path, "wb") as f:
+        pickle.dump(source_hash, f, protocol=pickle.HIGHEST_PROTOCOL)
+        pickle.dump(intern_strings(data), f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(temporary_path, snapshot_path)
+
+
+def load_snapshot(snapshot_path: str, source_hash: Optional[str] = None) -> dict:
+    """
+    Reads data from binary snapshot. If source_hash is given, snapshot has to be saved with the same hash.
+    """
+    with open(snapshot_path, "rb") as f:
+        saved_hash = pickle.load(f)
+        if source_hash is not None and saved_hash != source_hash:
+            raise Exception(f"Snapshot is not up to date: {snapshot_path}")
+        return pickle.load(f)
+
+
+def hash_paths(paths: Iterable[str]) -> str:
+    """
+    Returns sha256 of contents of files. Directory is hashed with names and contents of all files in it.
+    """
+    import hashlib
+
+    digest = hashlib.sha256()
+    for root_path in paths:
+        if path.isdir(root_path):
+            file_paths = sorted(str(file_path) for file_path in Path(root_path).rglob("*") if file_path.is_file())
+        else:
+            file_paths = [root_path]
+
+        for file_path in file_paths:
+            digest.update(path.relpath(file_path, root_path).encode("utf-8") + b"\0")
+            with open(file_path, "rb") as f:
+                for block in iter(lambda: f.read(2**20), b""):
+                    digest.update(block)
+
+    return digest.hexdigest()
+
+
 def save_json(json_path: str, data: Any):
     with open(json_path, "w") as f:
         return json.dump(data, f, indent=2)
 
 
+def yield_jsonl(jsonl_path: str) -> Iterator[Any]:
+    """
+    Yields records from JSON Lines file one by one, "-" means standard input.
+    """
+    with (sys.stdin if jsonl_path == "-" else open(jsonl_path)) as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def save_jsonl(jsonl_path: str, records: Iterable[Any]):
+    """
+    Writes records to JSON Lines file as they are produced, "-" means standard output.
+    """
+    f = sys.stdout if jsonl_path == "-" else open(jsonl_path, "w")
+    try:
+        for record in records:
+            f.write(json.dumps(record) + "\n")
+    finally:
+        if f is not sys.stdout:
+            f.close()
+
+
 def save_database(data: dict = DATABASE) -> dict:
-    "Writes database to json file after using option openpgx update"
-    save_json(DATABASE_PATH, data)
+    "Writes database to json file and its binary snapshot after using option openpgx update"
+    # Running processes may reload database at any moment, so they should never see partially written file
+    # Snapshot is written first, so replacing json triggers single reload (see DatabaseHandle), which reads snapshot
+    temporary_path = DATABASE_PATH + ".tmp"
+    save_json(temporary_path, data)
+    save_snapshot(snapshot_path_for(DATABASE_PATH), data, hash_paths([temporary_path]))
+    os.replace(temporary_path, DATABASE_PATH)
 
 
 
@@ -78,27 +263,43 @@ def index_items_by_key(items: list, key: str) -> dict:
     return dict(result)
 
 
-def with_logs(fn):
-    def fn_with_logs(*args, **kwargs):
-        warnings = []
-        errors = []
+# Lists of warnings and errors collected by with_logs in current context (thread or asyncio task)
+LOG_COLLECTORS = ContextVar("openpgx_log_collectors", default=())
 
-        def log(record):
-            entry = {"message": record["message"], **record["extra"]}
 
-            if record["level"].name == "WARNING":
-                warnings.append(entry)
+def collect_log_record(record) -> bool:
+    """
+    Filter of permanent logger handler, that adds WARNING and ERROR records to collectors of current context
+    """
+    collectors = LOG_COLLECTORS.get()
+    level = record["level"].name
 
-            if record["level"].name == "ERROR":
-                errors.append(entry)
+    if collectors and level in ["WARNING", "ERROR"]:
+        entry = {"message": record["message"], **record["extra"]}
+        for collector in collectors:
+            collector[level].append(entry)
+
+    return False
 
-            return False
 
-        handler_id = logger.add(lambda x: x, filter=log)
-        result = fn(*args, **kwargs)
-        result["warnings"] = warnings
-        result["errors"] = errors
-        logger.remove(handler_id)
+def with_logs(fn):
+    """
+    Adds "warnings" and "errors" logged during call of fn to its result. Logs are collected per context,
+    so concurrent calls in threads or asyncio tasks never get logs of each other. Handler collecting logs
+    is added again if it was removed from logger (see restore_log_collector_handler).
+    """
+    def fn_with_logs(*args, **kwargs):
+        restore_log_collector_handler()
+        collector = {"WARNING": [], "ERROR": []}
+        token = LOG_COLLECTORS.set(LOG_COLLECTORS.get() + (collector,))
+
+        try:
+            result = fn(*args, **kwargs)
+        finally:
+            LOG_COLLECTORS.reset(token)
+
+        result["warnings"] = collector["WARNING"]
+        result["errors"] = collector["ERROR"]
         return result
 
     return fn_with_logs
@@ -141,17 +342,106 @@ def _key_without_description(recommendation: dict) -> str:
 
 
 # assert normalize_gene_and_factor("HLA-A*31:01", "*31:01 positive") == ("HLA-A*31:01", "positive")
-def download_url(url: str, save_path: str):
-    logger.info("Downloading file", url=url, path=save_path)
-    request = Request(
-        url=url,
-        headers={
-            "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10.15; rv:91.0) Gecko/20100101 Firefox/91.0"
-        },
-    )
-    response = urlopen(request)
-    with open(save_path, "wb") as file:
-        file.write(response.read())
+# Size of chunks in which downloaded files are written to disk
+DOWNLOAD_CHUNK_SIZE = 2**20
+
+
+def download_metadata_path(save_path: str) -> str:
+    "Path of file next to downloaded file, where its ETag, Last-Modified and sha256 are stored"
+    return save_path + ".download.json"
+
+
+def load_download_metadata(save_path: str) -> dict:
+    metadata_path = download_metadata_path(save_path)
+    if not path.exists(save_path) or not path.exists(metadata_path):
+        return {}
+    return load_json(metadata_path)
+
+
+def download_url(url: str, save_path: str, sha256: Optional[str] = None, revalidate: bool = True) -> bool:
+    """
+    Downloads url to save_path, returns False if existing file was up to date and True otherwise.
+
+    Response is written in chunks to save_path + ".part", which is renamed to save_path only when complete.
+    Download interrupted before is resumed with Range request. If save_path exists and revalidate is set,
+    request is conditional (If-None-Match / If-Modified-Since), so unchanged file is not downloaded again.
+
+    sha256: expected checksum of file, file with other checksum is rejected
+    """
+    import hashlib
+    from urllib.error import HTTPError
+    from urllib.request import Request, urlopen
+
+    part_path = save_path + ".part"
+    metadata = load_download_metadata(save_path)
+    part_metadata = load_download_metadata(part_path)
+
+    headers = {
+        "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10.15; rv:91.0) Gecko/20100101 Firefox/91.0"
+    }
+    offset = path.getsize(part_path) if path.exists(part_path) else 0
+
+    if offset > 0:
+        headers["Range"] = f"bytes={offset}-"
+        # Server sends whole file instead of the rest, if it changed since download was interrupted
+        if part_metadata.get("etag") or part_metadata.get("last_modified"):
+            headers["If-Range"] = part_metadata.get("etag") or part_metadata["last_modified"]
+    elif path.exists(save_path) and revalidate:
+        if metadata.get("etag"):
+            headers["If-None-Match"] = metadata["etag"]
+        if metadata.get("last_modified"):
+            headers["If-Modified-Since"] = metadata["last_modified"]
+
+    logger.info("Downloading file", url=url, path=save_path, offset=offset)
+    try:
+        response = urlopen(Request(url=url, headers=headers))
+    except HTTPError as e:
+        if e.code == 304:
+            logger.info("File not modified", url=url, path=save_path)
+            return False
+        if e.code == 416 and offset > 0:
+            # Range of interrupted download is no longer valid, so it is started from the beginning
+            os.remove(part_path)
+            return download_url(url, save_path, sha256, revalidate)
+        raise
+
+    with response:
+        if response.status == 206:
+            expected_size = int(response.headers["Content-Range"].split("/")[-1])
+        else:
+            offset = 0
+            expected_size = int(response.headers["Content-Length"]) if response.headers["Content-Length"] else None
+
+        part_metadata = {
+            "url": url,
+            "etag": response.headers["ETag"],
+            "last_modified": response.headers["Last-Modified"],
+        }
+        save_json(download_metadata_path(part_path), part_metadata)
+
+        with open(part_path, "ab" if offset > 0 else "wb") as file:
+            for chunk in iter(lambda: response.read(DOWNLOAD_CHUNK_SIZE), b""):
+                file.write(chunk)
+
+    size = path.getsize(part_path)
+    if expected_size is not None and size != expected_size:
+        raise Exception(f"Incomplete download of {url}: {size} of {expected_size} bytes, run again to resume")
+
+    digest = hashlib.sha256()
+    with open(part_path, "rb") as file:
+        for chunk in iter(lambda: file.read(DOWNLOAD_CHUNK_SIZE), b""):
+            digest.update(chunk)
+
+    if sha256 is not None and digest.hexdigest() != sha256.lower():
+        os.remove(part_path)
+        os.remove(download_metadata_path(part_path))
+        raise Exception(f"Checksum of {url} is {digest.hexdigest()}, expected {sha256}")
+
+    os.replace(part_path, save_path)
+    save_json(download_metadata_path(save_path), {**part_metadata, "sha256": digest.hexdigest()})
+    os.remove(download_metadata_path(part_path))
+
+    return True
 
 
 def url_to_cache_dir(url: str) -> str:
@@ -165,41 +455,73 @@ def cache_path(path: str) -> str:
     return repository_path(".cache/" + path)
 
 
-def get_cache_dir_for_url(url: str) -> str:
+def get_cache_dir_for_url(url: str, create: bool = True) -> str:
     cache_dir = repository_path(".cache/" + url_to_cache_dir(url))
 
-    if not path.exists(cache_dir):
+    if create and not path.exists(cache_dir):
         os.makedirs(cache_dir)
 
     return cache_dir
 
 
-def download_to_cache_dir(url, force=False):
-    if url.endswith(".zip"):
-        cache_dir = get_cache_dir_for_url(url)
+# Urls revalidated by download_to_cache_dir in this process
+REVALIDATED_URLS = set()
 
-        if not force and len(os.listdir(cache_dir)) > 0:
-            return cache_dir
 
-        with tempfile.TemporaryDirectory(prefix="openpgx") as tmpdirname:
-            filename_path = path.join(tmpdirname, path.basename(url))
-
-            download_url(url, filename_path)
+def download_to_cache_dir(url, force=False, sha256: Optional[str] = None, extract: bool = True):
+    """
+    Downloads url to cache directory and returns path of downloaded file (or directory with extracted zip file,
+    unless extract is False).
 
-            with zipfile.ZipFile(filename_path, "r") as zip_ref:
-                zip_ref.extractall(cache_dir)
+    File that is already in cache is revalidated once per process (see download_url), and is used as it is
+    if server cannot be reached. With force, file is downloaded again even if it was not modified.
+    """
+    import shutil
+    import zipfile
+    from urllib.error import URLError
 
-            return cache_dir
+    # Zip archive is kept next to directory it is extracted to, which is created only when extracting
+    cache_dir = get_cache_dir_for_url(url, create=not url.endswith(".zip"))
+    if url.endswith(".zip"):
+        download_path = cache_dir + ".zip"
+        os.makedirs(path.dirname(download_path), exist_ok=True)
     else:
-        cache_dir = get_cache_dir_for_url(url)
         download_path = path.join(cache_dir, path.basename(url))
-        if not force and os.path.exists(download_path):
-            return download_path
-        download_url(url, download_path)
+
+    if force and path.exists(download_path):
+        os.remove(download_path)
+
+    downloaded = False
+    if not path.exists(download_path) or url not in REVALIDATED_URLS:
+        try:
+            downloaded = download_url(url, download_path, sha256)
+        except URLError as e:
+            if not path.exists(download_path):
+                raise
+            logger.warning("Could not revalidate cached file", url=url, path=download_path, error=str(e))
+        REVALIDATED_URLS.add(url)
+
+    if not url.endswith(".zip") or not extract:
         return download_path
 
+    if downloaded or not path.isdir(cache_dir) or len(os.listdir(cache_dir)) == 0:
+        if path.isdir(cache_dir):
+            shutil.rmtree(cache_dir)
+        with zipfile.ZipFile(download_path, "r") as zip_ref:
+            zip_ref.extractall(cache_dir)
+
+    return cache_dir
+
+
+def add_stacktrace(record):
+    tb = traceback.extract_stack()
+    tb = [f"{t[1]}: {t[3]}" for t in tb[::-1] if t.filename == tb[-1].filename]
+    record["stacktrace"] = "\n".join(list(dict.fromkeys(tb[2:])))
+
 
 def add_traceback(record):
+    from termcolor import colored
+
     if record["level"].name == "ERROR":
         record["message"] = colored(record["message"], "red")
     elif record["level"].name == "WARNING":
@@ -207,17 +529,88 @@ def add_traceback(record):
     else:
         record["message"] = record["message"]
 
-    tb = traceback.extract_stack()
-    tb = [f"{t[1]}: {t[3]}" for t in tb[::-1] if t.filename == tb[-1].filename]
-    record["stacktrace"] = "\n".join(list(dict.fromkeys(tb[2:])))
+    add_stacktrace(record)
+
 
+# "development": every record is colored and gets stacktrace, even if no sink displays it
+# "production": records are formatted only by sinks that accept them, stacktrace is captured only
+#   if OPENPGX_LOG_STACKTRACE=1, and sinks added with add_log_sink are non-blocking (queued)
+LOG_MODE = os.environ.get("OPENPGX_LOG_MODE", "development")
+LOG_STACKTRACE = os.environ.get("OPENPGX_LOG_STACKTRACE") == "1"
+LOGGER = None
 
-logger.configure(
-    handlers=[
-        {"sink": lambda x: x, "format": "{line}: {message} {extra}\n{stacktrace}\n"}
-    ],
-    patcher=add_traceback,
-)
+# Permanent handler collecting warnings and errors for with_logs, it never formats records
+LOG_COLLECTOR_HANDLER = {"sink": lambda x: x, "level": "WARNING", "filter": collect_log_record}
+LOG_COLLECTOR_HANDLER_ID = None
+
+
+def configure_logger(mode: str = None, stacktrace: bool = None):
+    """
+    (Re)configures loguru logger for given mode, see LOG_MODE. Removes all previously added sinks.
+    """
+    global LOG_MODE, LOG_STACKTRACE, LOGGER, LOG_COLLECTOR_HANDLER_ID
+    from loguru import logger as loguru_logger
+
+    if mode is not None:
+        LOG_MODE = mode
+    if stacktrace is not None:
+        LOG_STACKTRACE = stacktrace
+
+    if LOG_MODE == "production":
+        # Patcher is replaced only if given, so it can't be None here
+        handler_ids = loguru_logger.configure(
+            handlers=[LOG_COLLECTOR_HANDLER], patcher=add_stacktrace if LOG_STACKTRACE else lambda record: None
+        )
+    else:
+        handler_ids = loguru_logger.configure(
+            handlers=[
+                LOG_COLLECTOR_HANDLER,
+                {"sink": lambda x: x, "format": "{line}: {message} {extra}\n{stacktrace}\n"},
+            ],
+            patcher=add_traceback,
+        )
+
+    LOG_COLLECTOR_HANDLER_ID = handler_ids[0]
+    LOGGER = loguru_logger
+    return LOGGER
+
+
+def restore_log_collector_handler():
+    """
+    Adds handler collecting logs for with_logs again, if it was removed by application using openpgx
+    (for example with logger.remove() or logger.configure(handlers=...)). Loguru has no public way
+    to list handlers, so its internal dictionary of handlers is checked.
+    """
+    global LOG_COLLECTOR_HANDLER_ID
+
+    if LOGGER is not None and LOG_COLLECTOR_HANDLER_ID not in LOGGER._core.handlers:
+        LOG_COLLECTOR_HANDLER_ID = LOGGER.add(**LOG_COLLECTOR_HANDLER)
+
+
+def get_logger():
+    """
+    Imports and configures loguru logger on first use, so it is not imported just to match genotypes
+    """
+    if LOGGER is None:
+        return configure_logger()
+
+    return LOGGER
+
+
+def add_log_sink(sink, **options) -> int:
+    """
+    Adds sink to logger. In production mode records are passed to sink through queue, so logging never blocks.
+    """
+    options.setdefault("enqueue", LOG_MODE == "production")
+    return logger.add(sink, **options)
+
+
+class LazyLogger:
+    def __getattr__(self, name):
+        return getattr(get_logger(), name)
+
+
+logger = LazyLogger()
 
 # ("HLA-B", "*57:01 positive") => ("HLA-B*57:01", "positive")
 def normalize_hla_gene_and_factor(genename: str, factor: str) -> Tuple[str, str]:
@@ -259,3 +652,114 @@ def strip_tags(html):
     s = MLStripper()
     s.feed(html)
     return s.get_data()
+
+
+class TableFound(Exception):
+    "Raised by FirstTableParser to stop parsing when the first table is closed"
+
+
+# Tags that never have contents, so they are never open
+VOID_TAGS = {
+    "area", "base", "br", "col", "embed", "hr", "img", "input", "keygen", "link", "menuitem", "meta", "param",
+    "source", "track", "wbr", "basefont", "bgsound", "command", "frame", "image", "isindex", "nextid", "spacer",
+}
+
+
+class FirstTableParser(HTMLParser):
+    """
+    Collects rows of the first table in html, as lists of texts of their cells. Result is the same as
+    with BeautifulSoup (html.parser): rows and cells of nested tables are rows and cells of outer table
+    as well, and closing tag closes all tags opened after its opening tag.
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.rows = []
+        # All open tags, as (tag, row or cell) pairs
+        self.open_tags = []
+        self.open_rows = []
+        self.open_cells = []
+        self.in_table = False
+        self.data = []
+
+    def handle_starttag(self, tag, attrs):
+        self.flush_data()
+        if tag in VOID_TAGS:
+            return
+
+        element = None
+        if tag == "table" and not self.in_table and not self.rows:
+            self.in_table = True
+        elif self.in_table and tag == "tr":
+            element = []
+            self.rows.append(element)
+            self.open_rows.append(element)
+        elif self.in_table and (tag == "td" or tag == "th"):
+            element = []
+            for row in self.open_rows:
+                row.append(element)
+            self.open_cells.append(element)
+
+        self.open_tags.append((tag, element))
+
+    def handle_endtag(self, tag):
+        self.flush_data()
+        if not any(open_tag == tag for open_tag, _ in self.open_tags):
+            return
+
+        while True:
+            open_tag, element = self.open_tags.pop()
+            if element is not None and open_tag == "tr":
+                self.open_rows.pop()
+            elif element is not None:
+                self.open_cells.pop()
+            elif open_tag == "table" and self.in_table and not any(t == "table" for t, _ in self.open_tags):
+                raise TableFound()
+
+            if open_tag == tag:
+                break
+
+    def handle_data(self, data):
+        self.data.append(data)
+
+    def flush_data(self):
+        "Adds text since previous tag to open cells"
+        if not self.data:
+            return
+
+        data = "".join(self.data)
+        self.data = []
+
+        # Like BeautifulSoup, text made only of whitespace is replaced by single new line or space
+        if data.strip(" \n\t\f\r") == "" and not any(tag in ("pre", "textarea") for tag, _ in self.open_tags):
+            data = "\n" if "\n" in data else " "
+
+        for cell in self.open_cells:
+            cell.append(data)
+
+    def handle_comment(self, data):
+        self.flush_data()
+
+    def unknown_decl(self, data):
+        self.flush_data()
+        if data.upper().startswith("CDATA["):
+            self.data.append(data[6:])
+            self.flush_data()
+
+    def get_rows(self) -> list:
+        return [["".join(cell) for cell in row] for row in self.rows]
+
+
+def first_table_from_html(html: str) -> list:
+    """
+    Returns rows of the first table in html, for example:
+        "<table><tr><th>A</th><th>B</th></tr><tr><td>1</td><td>2</td></tr></table>" => [["A", "B"], ["1", "2"]]
+    """
+    parser = FirstTableParser()
+    try:
+        parser.feed(html)
+        parser.close()
+        parser.flush_data()
+    except TableFound:
+        pass
+    return parser.get_rows()
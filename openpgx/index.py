@@ -0,0 +1,228 @@
+from collections import defaultdict
+
+# Names of source databases, each of them has "recommendations" and "encodings"
+SOURCES = ["cpic", "dpwg", "fda"]
+
+# activity score factors: "== 2.00" and ">= 2.00"
+SCORE_OPERATORS = ["==", ">="]
+
+
+def is_score_factor(factor: str) -> bool:
+    return "= " in factor and factor[0:2] in SCORE_OPERATORS
+
+
+class EqualsPredicate:
+    """
+    Factor other than activity score (phenotype, genotype), matches encoding equal to factor.
+    """
+
+    __slots__ = ["factor"]
+
+    def __init__(self, factor: str):
+        self.factor = factor
+
+    def matches(self, encoding) -> bool:
+        return encoding == self.factor
+
+
+class ScoreEqualsPredicate(EqualsPredicate):
+    """
+    Activity score factor "== 2.00", matches activity score equal to threshold
+    """
+
+    __slots__ = ["threshold"]
+
+    def __init__(self, factor: str, threshold: float):
+        super().__init__(factor)
+        self.threshold = threshold
+
+    def matches(self, encoding) -> bool:
+        if type(encoding) == str:
+            return encoding == self.factor
+        return encoding == self.threshold
+
+
+class ScoreAtLeastPredicate(ScoreEqualsPredicate):
+    """
+    Activity score factor ">= 2.00", matches activity score greater or equal to threshold
+    """
+
+    __slots__ = []
+
+    def matches(self, encoding) -> bool:
+        if type(encoding) == str:
+            return encoding == self.factor
+        return encoding is not None and encoding >= self.threshold
+
+
+# Cache of compiled predicates by factor string, filled when database is loaded
+FACTOR_PREDICATES = {}
+
+
+def compile_factor(factor: str) -> EqualsPredicate:
+    """
+    Parses factor string into predicate, for example:
+        "poor metabolizer" => EqualsPredicate("poor metabolizer")
+        ">= 1.50"          => ScoreAtLeastPredicate(">= 1.50", 1.5)
+    """
+    if factor in FACTOR_PREDICATES:
+        return FACTOR_PREDICATES[factor]
+
+    if is_score_factor(factor):
+        operator, threshold = factor[0:2], float(factor[2:])
+        if operator == "==":
+            predicate = ScoreEqualsPredicate(factor, threshold)
+        else:
+            predicate = ScoreAtLeastPredicate(factor, threshold)
+    else:
+        predicate = EqualsPredicate(factor)
+
+    FACTOR_PREDICATES[factor] = predicate
+    return predicate
+
+
+def create_source_index(recommendations: dict) -> dict:
+    """
+    Creates inverted index of recommendations in single source database (cpic, dpwg, fda).
+
+    Each recommendation gets an id (position in "entries") and is indexed by every
+    gene and factor value it requires, for example:
+        {
+            "entries": [("abacavir", {"factors": {"HLA-B*57:01": "negative"}, ...}), ...],
+            "sizes": [1, ...],
+            "unconditional": [ids of recommendations without factors],
+            "genes": {
+                "HLA-B*57:01": {"equals": {"negative": [0]}, "at_least": []},
+                "CYP2D6": {"equals": {"== 1.00": [7], 1.0: [7]}, "at_least": [(1.5, [8])]},
+            }
+        }
+
+    Recommendations with factor equal to None are never matched, so they are not indexed.
+    """
+    entries = []
+    sizes = []
+    unconditional = []
+    genes = defaultdict(lambda: {"equals": defaultdict(list), "at_least": defaultdict(list)})
+
+    for drug, drug_recommendations in recommendations.items():
+        for recommendation in drug_recommendations:
+            factors = recommendation["factors"]
+            if any(factor is None for factor in factors.values()):
+                continue
+
+            recommendation_id = len(entries)
+            entries.append((drug, recommendation))
+            sizes.append(len(factors))
+
+            if len(factors) == 0:
+                unconditional.append(recommendation_id)
+
+            for gene, factor in factors.items():
+                gene_index = genes[gene]
+                predicate = compile_factor(factor)
+                # Encodings that are strings are compared with factor as is
+                gene_index["equals"][factor].append(recommendation_id)
+
+                if type(predicate) == ScoreEqualsPredicate:
+                    gene_index["equals"][predicate.threshold].append(recommendation_id)
+                elif type(predicate) == ScoreAtLeastPredicate:
+                    gene_index["at_least"][predicate.threshold].append(recommendation_id)
+
+    return {
+        "entries": entries,
+        "sizes": sizes,
+        "unconditional": unconditional,
+        "genes": {
+            gene: {
+                "equals": dict(gene_index["equals"]),
+                "at_least": sorted(gene_index["at_least"].items()),
+            }
+            for gene, gene_index in genes.items()
+        },
+    }
+
+
+def create_phenotypes_lookup(database: dict) -> dict:
+    """
+    Merges encodings of cpic and dpwg into single table used by phenotyping, where every accepted
+    spelling of genotype (both orders of alleles) maps directly to encodings, for example:
+        {"CYP2D6": {"*1≥3/*2≥3": ["ultrarapid metabolizer", 6.0], "*2≥3/*1≥3": ["ultrarapid metabolizer", 6.0]}}
+
+    If genotype is in both databases, encodings from dpwg are used.
+    """
+    lookup = defaultdict(dict)
+
+    for source in ["cpic", "dpwg"]:
+        for gene, gene_encodings in database[source]["encodings"].items():
+            for genotype, encodings in gene_encodings.items():
+                alleles = genotype.split("/")
+                # Genotypes are looked up with sorted alleles, so other ones can never match
+                if "/".join(sorted(alleles)) != genotype:
+                    continue
+
+                lookup[gene][genotype] = encodings
+                lookup[gene]["/".join(reversed(alleles))] = encodings
+
+    return dict(lookup)
+
+
+def compile_database(database: dict) -> dict:
+    """
+    Adds "index" (see create_source_index) to every source of database loaded from database.json.
+    Every factor in database is compiled to predicate (see compile_factor) once here.
+
+    Databases created before "phenotypes" table was introduced get it here as well.
+    """
+    for source in SOURCES:
+        database[source]["index"] = create_source_index(database[source]["recommendations"])
+
+    if "phenotypes" not in database:
+        database["phenotypes"] = create_phenotypes_lookup(database)
+
+    return database
+
+
+def find_matching_recommendations(index: dict, encodings: dict) -> list:
+    """
+    Returns (drug, recommendation) pairs from source index whose all factors match encodings.
+    Order is the same as order of recommendations in database.
+
+    encodings: result of phenotyping, for example {"CYP2D6": ["poor metabolizer", 0.0]}
+    """
+    genes = index["genes"]
+    sizes = index["sizes"]
+    matched_factors = defaultdict(int)
+
+    for gene, gene_encodings in encodings.items():
+        if gene not in genes:
+            continue
+
+        gene_index = genes[gene]
+        if type(gene_encodings) != list:
+            gene_encodings = [gene_encodings]
+
+        matched = set()
+        for encoding in gene_encodings:
+            if encoding is None:
+                continue
+
+            matched.update(gene_index["equals"].get(encoding, ()))
+
+            if type(encoding) != str:
+                for threshold, recommendation_ids in gene_index["at_least"]:
+                    if encoding < threshold:
+                        break
+                    matched.update(recommendation_ids)
+
+        for recommendation_id in matched:
+            matched_factors[recommendation_id] += 1
+
+    recommendation_ids = [
+        recommendation_id
+        for recommendation_id, count in matched_factors.items()
+        if count == sizes[recommendation_id]
+    ]
+    recommendation_ids.extend(index["unconditional"])
+
+    entries = index["entries"]
+    return [entries[recommendation_id] for recommendation_id in sorted(recommendation_ids)]
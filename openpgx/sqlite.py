@@ -0,0 +1,212 @@
+"""
+Optional SQLite storage of database. Recommendations, their factors and phenotypes lookup are stored in indexed
+tables, so matching runs as indexed queries and many processes can share single database file on disk.
+"""
+import json
+import os
+import sqlite3
+from collections import defaultdict
+from typing import Optional
+
+from openpgx import get_best_recommendation, recommendation_matches_genotype
+from openpgx.helpers import repository_path
+from openpgx.index import SOURCES, ScoreAtLeastPredicate, ScoreEqualsPredicate, compile_factor, create_phenotypes_lookup
+
+SQLITE_DATABASE_PATH = repository_path("database.sqlite")
+
+SCHEMA = """
+CREATE TABLE drugs (position INTEGER PRIMARY KEY, drug TEXT NOT NULL UNIQUE);
+CREATE TABLE recommendations (
+    id INTEGER PRIMARY KEY, source TEXT NOT NULL, drug TEXT NOT NULL, size INTEGER NOT NULL, data TEXT NOT NULL
+);
+CREATE TABLE factors (
+    recommendation_id INTEGER NOT NULL, size INTEGER NOT NULL,
+    gene TEXT NOT NULL, factor TEXT NOT NULL, operator TEXT, threshold REAL
+);
+CREATE TABLE encodings (gene TEXT NOT NULL, genotype TEXT NOT NULL, data TEXT NOT NULL, PRIMARY KEY (gene, genotype));
+CREATE INDEX recommendations_drug ON recommendations (drug, source);
+CREATE INDEX recommendations_source ON recommendations (source);
+CREATE INDEX recommendations_size ON recommendations (size);
+CREATE INDEX factors_gene ON factors (gene, factor);
+"""
+
+
+def save_sqlite_database(database: dict, sqlite_path: str = SQLITE_DATABASE_PATH):
+    """
+    Writes database created by create_database to SQLite file, replacing existing one
+    """
+    temporary_path = sqlite_path + ".tmp"
+    if os.path.exists(temporary_path):
+        os.remove(temporary_path)
+
+    connection = sqlite3.connect(temporary_path)
+    with connection:
+        connection.executescript(SCHEMA)
+
+        drugs = {}
+        for source in SOURCES:
+            for drug, drug_recommendations in database[source]["recommendations"].items():
+                drugs.setdefault(drug, len(drugs))
+
+                for recommendation in drug_recommendations:
+                    factors = recommendation["factors"]
+                    recommendation_id = connection.execute(
+                        "INSERT INTO recommendations (source, drug, size, data) VALUES (?, ?, ?, ?)",
+                        (source, drug, len(factors), json.dumps(recommendation)),
+                    ).lastrowid
+
+                    # Recommendations with factor equal to None never match, so their factors are not stored
+                    if any(factor is None for factor in factors.values()):
+                        continue
+
+                    for gene, factor in factors.items():
+                        predicate = compile_factor(factor)
+                        operator, threshold = None, None
+                        if type(predicate) == ScoreEqualsPredicate:
+                            operator, threshold = "==", predicate.threshold
+                        elif type(predicate) == ScoreAtLeastPredicate:
+                            operator, threshold = ">=", predicate.threshold
+
+                        connection.execute(
+                            "INSERT INTO factors VALUES (?, ?, ?, ?, ?, ?)",
+                            (recommendation_id, len(factors), gene, factor, operator, threshold),
+                        )
+
+        connection.executemany("INSERT INTO drugs VALUES (?, ?)", [(position, drug) for drug, position in drugs.items()])
+
+        phenotypes = database.get("phenotypes") or create_phenotypes_lookup(database)
+        connection.executemany(
+            "INSERT INTO encodings VALUES (?, ?, ?)",
+            [
+                (gene, genotype, json.dumps(encodings))
+                for gene, gene_phenotypes in phenotypes.items()
+                for genotype, encodings in gene_phenotypes.items()
+            ],
+        )
+
+    connection.close()
+    os.replace(temporary_path, sqlite_path)
+
+
+CONNECTIONS = {}
+
+
+def get_connection(sqlite_path: str = SQLITE_DATABASE_PATH) -> sqlite3.Connection:
+    """
+    Returns read-only connection to SQLite database, opened once for each file in each process
+    """
+    key = (os.getpid(), sqlite_path)
+
+    if key not in CONNECTIONS:
+        CONNECTIONS[key] = sqlite3.connect(f"file:{sqlite_path}?mode=ro", uri=True, check_same_thread=False)
+
+    return CONNECTIONS[key]
+
+
+def phenotyping(genotypes: dict, connection: sqlite3.Connection) -> dict:
+    """
+    The same as openpgx.phenotyping, but encodings are queried from SQLite database
+    """
+    phenotyping_result = {}
+    for gene, genotype in genotypes.items():
+        row = connection.execute(
+            "SELECT data FROM encodings WHERE gene = ? AND genotype = ?", (gene, genotype)
+        ).fetchone()
+        if row is None and genotype.count("/") > 1:
+            row = connection.execute(
+                "SELECT data FROM encodings WHERE gene = ? AND genotype = ?",
+                (gene, "/".join(sorted(genotype.split("/")))),
+            ).fetchone()
+        phenotyping_result[gene] = json.loads(row[0]) if row is not None else []
+    return phenotyping_result
+
+
+def get_recommendation_for_drug(
+    connection: sqlite3.Connection, source: str, drug: str, encodings: dict
+) -> Optional[dict]:
+    """
+    The same as openpgx.get_recommendation_for_drug, but recommendations are queried from SQLite database
+    """
+    matched_recommendations = []
+
+    for (data,) in connection.execute(
+        "SELECT data FROM recommendations WHERE drug = ? AND source = ? ORDER BY id", (drug, source)
+    ):
+        recommendation = json.loads(data)
+        if recommendation_matches_genotype(recommendation, encodings):
+            matched_recommendations.append(recommendation)
+
+    if len(matched_recommendations) > 0:
+        return get_best_recommendation(matched_recommendations)
+
+    return None
+
+
+def find_matching_recommendation_ids(connection: sqlite3.Connection, encodings: dict) -> list:
+    """
+    Returns ids of recommendations whose all factors match encodings, using index of factors table
+    """
+    matched_factors = defaultdict(int)
+    sizes = {}
+
+    for gene, gene_encodings in encodings.items():
+        if type(gene_encodings) != list:
+            gene_encodings = [gene_encodings]
+
+        strings = [encoding for encoding in gene_encodings if type(encoding) == str]
+        scores = [encoding for encoding in gene_encodings if type(encoding) != str and encoding is not None]
+
+        rows = []
+        if strings:
+            rows.extend(connection.execute(
+                f"SELECT recommendation_id, size FROM factors WHERE gene = ? AND factor IN ({', '.join('?' * len(strings))})",
+                (gene, *strings),
+            ))
+        for score in scores:
+            rows.extend(connection.execute(
+                "SELECT recommendation_id, size FROM factors WHERE gene = ? AND ("
+                "(operator = '==' AND threshold = ?) OR (operator = '>=' AND threshold <= ?))",
+                (gene, score, score),
+            ))
+
+        for recommendation_id, size in set(rows):
+            matched_factors[recommendation_id] += 1
+            sizes[recommendation_id] = size
+
+    recommendation_ids = [
+        recommendation_id for recommendation_id, count in matched_factors.items() if count == sizes[recommendation_id]
+    ]
+    recommendation_ids.extend(
+        recommendation_id for (recommendation_id,) in connection.execute("SELECT id FROM recommendations WHERE size = 0")
+    )
+
+    return sorted(recommendation_ids)
+
+
+def get_recommendations_for_patient(genotypes: dict, connection: sqlite3.Connection = None) -> dict:
+    """
+    The same as openpgx.get_recommendations_for_patient, but matching runs as indexed queries
+    against SQLite database, instead of database loaded to memory.
+    """
+    if connection is None:
+        connection = get_connection()
+
+    encodings = phenotyping(genotypes, connection)
+
+    recommendations = {
+        drug: {source: [] for source in SOURCES}
+        for (drug,) in connection.execute("SELECT drug FROM drugs ORDER BY position")
+    }
+
+    recommendation_ids = find_matching_recommendation_ids(connection, encodings)
+    matched = defaultdict(list)
+    for recommendation_id in recommendation_ids:
+        source, drug, data = connection.execute(
+            "SELECT source, drug, data FROM recommendations WHERE id = ?", (recommendation_id,)
+        ).fetchone()
+        matched[(drug, source)].append(json.loads(data))
+
+    for (drug, source), matched_recommendations in matched.items():
+        recommendations[drug][source].append(get_best_recommendation(matched_recommendations))
+
+    return recommendations
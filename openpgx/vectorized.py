@@ -0,0 +1,146 @@
+"""
+Matching engine for large cohorts. Phenotyping results of the whole cohort are stored as NumPy columns
+(one pair of columns per gene) and every factor of every recommendation is evaluated for all patients at once.
+"""
+from collections import defaultdict
+
+import numpy as np
+
+from openpgx import get_drugs, phenotyping
+from openpgx.helpers import get_database
+from openpgx.index import SOURCES, ScoreAtLeastPredicate, ScoreEqualsPredicate, compile_factor
+
+
+def create_encoding_columns(encodings_list: list) -> tuple:
+    """
+    Converts phenotyping results of cohort to columns, for example for two patients:
+        [{"CYP2D6": ["poor metabolizer", 0.0]}, {"CYP2D6": ["normal metabolizer", "normal", 2.0]}]
+    =>
+        vocabulary: {"poor metabolizer": 0, "normal metabolizer": 1, "normal": 2}
+        columns: {"CYP2D6": (
+            array([[0, -1], [1, 2]]),  # integer codes of phenotypes and genotypes, -1 is empty
+            array([[0.0], [2.0]]),  # activity scores, NaN is empty
+        )}
+    """
+    vocabulary = {}
+    strings_by_gene = defaultdict(dict)
+    scores_by_gene = defaultdict(dict)
+
+    for patient, encodings in enumerate(encodings_list):
+        for gene, gene_encodings in encodings.items():
+            if type(gene_encodings) != list:
+                gene_encodings = [gene_encodings]
+
+            codes, scores = [], []
+            for encoding in gene_encodings:
+                if type(encoding) == str:
+                    codes.append(vocabulary.setdefault(encoding, len(vocabulary)))
+                elif encoding is not None:
+                    scores.append(float(encoding))
+
+            if codes:
+                strings_by_gene[gene][patient] = codes
+            if scores:
+                scores_by_gene[gene][patient] = scores
+
+    def to_array(values_by_patient: dict, empty, dtype):
+        width = max((len(values) for values in values_by_patient.values()), default=0)
+        array = np.full((len(encodings_list), width), empty, dtype=dtype)
+        for patient, values in values_by_patient.items():
+            array[patient, 0 : len(values)] = values
+        return array
+
+    columns = {
+        gene: (
+            to_array(strings_by_gene.get(gene, {}), -1, np.int32),
+            to_array(scores_by_gene.get(gene, {}), np.nan, np.float64),
+        )
+        for gene in set(strings_by_gene) | set(scores_by_gene)
+    }
+
+    return vocabulary, columns
+
+
+def get_factor_mask(vocabulary: dict, columns: dict, gene: str, factor: str, size: int) -> np.ndarray:
+    """
+    Returns boolean array telling which patients match factor for gene (see does_encoding_match_factor)
+    """
+    if gene not in columns:
+        return np.zeros(size, dtype=bool)
+
+    codes, scores = columns[gene]
+
+    # Phenotypes and genotypes are compared with factor as is
+    if factor in vocabulary:
+        mask = (codes == vocabulary[factor]).any(axis=1)
+    else:
+        mask = np.zeros(size, dtype=bool)
+
+    predicate = compile_factor(factor)
+    if type(predicate) == ScoreEqualsPredicate:
+        mask |= (scores == predicate.threshold).any(axis=1)
+    elif type(predicate) == ScoreAtLeastPredicate:
+        mask |= (scores >= predicate.threshold).any(axis=1)
+
+    return mask
+
+
+def get_recommendations_for_cohort(genotypes_list: list) -> list:
+    """
+    Returns the same result as get_recommendations_for_patients, but matching is done with
+    vectorized comparisons across all patients instead of loop over patients.
+    """
+    database = get_database()
+    size = len(genotypes_list)
+
+    encodings_list = [phenotyping(genotypes, database) for genotypes in genotypes_list]
+    vocabulary, columns = create_encoding_columns(encodings_list)
+    factor_masks = {}
+
+    # Columns of "selected" are (drug, source) pairs, values are ids of best recommendation or -1
+    selected_columns = []
+    selected = []
+
+    for source in SOURCES:
+        index = database[source]["index"]
+        entries = index["entries"]
+
+        ids_by_drug = defaultdict(list)
+        for recommendation_id, (drug, _) in enumerate(entries):
+            ids_by_drug[drug].append(recommendation_id)
+
+        for drug, recommendation_ids in ids_by_drug.items():
+            best = np.full(size, -1, dtype=np.int32)
+
+            # The same order of preference as in get_best_recommendation: most factors first, then first in database
+            for recommendation_id in sorted(recommendation_ids, key=lambda i: -index["sizes"][i]):
+                mask = best < 0
+                for gene, factor in entries[recommendation_id][1]["factors"].items():
+                    if (gene, factor) not in factor_masks:
+                        factor_masks[(gene, factor)] = get_factor_mask(vocabulary, columns, gene, factor, size)
+                    mask &= factor_masks[(gene, factor)]
+                best[mask] = recommendation_id
+
+            selected_columns.append((drug, source))
+            selected.append(best)
+
+    if size == 0:
+        return []
+
+    # Patients with the same selected recommendations share result dictionary
+    selected = np.ascontiguousarray(np.stack(selected, axis=1) if selected else np.zeros((size, 0), dtype=np.int32))
+    drugs = get_drugs(database)
+
+    results_by_row = {}
+    results = []
+    for row in selected:
+        key = row.tobytes()
+        if key not in results_by_row:
+            recommendations = {drug: {source: [] for source in SOURCES} for drug in drugs}
+            for (drug, source), recommendation_id in zip(selected_columns, row):
+                if recommendation_id >= 0:
+                    recommendations[drug][source] = [database[source]["index"]["entries"][recommendation_id][1]]
+            results_by_row[key] = recommendations
+        results.append(results_by_row[key])
+
+    return results
@@ -50,7 +50,6 @@ package(
     install_requires=[
         "loguru",
         "termcolor",
-        "bs4",
         "appdirs",
         "numpy"
     ],
@@ -0,0 +1,37 @@
+from openpgx import get_drugs, get_recommendations_for_patient
+from openpgx.blocks import *
+from openpgx.helpers import get_database
+
+database = get_database()
+
+
+def test_blocks_database(tmp_path):
+    blocks_path = str(tmp_path / "database.blocks")
+    save_blocks_database(database, blocks_path)
+    blocks_database = load_blocks_database(blocks_path)
+
+    assert get_drugs(blocks_database) == get_drugs(database)
+    assert len(blocks_database["cpic"]["recommendations"].loaded) == 0
+
+    genotypes = {"CYP2D6": "*7/*7", "CYP2C19": "*1/*2"}
+    recommendations = get_recommendations_for_drugs(genotypes, ["trimipramine", "abacavir"], blocks_database)
+
+    expected = get_recommendations_for_patient(genotypes)
+    assert recommendations == {"trimipramine": expected["trimipramine"], "abacavir": expected["abacavir"]}
+    assert list(blocks_database["cpic"]["recommendations"].loaded.keys()) == ["trimipramine", "abacavir"]
+
+
+def test_save_blocks_database_while_previous_file_is_read(tmp_path):
+    blocks_path = str(tmp_path / "database.blocks")
+    previous = {
+        source: {"recommendations": {"drug": [{"factors": {}, "recommendation": "x" * 1000}]}, "encodings": {}}
+        for source in SOURCES
+    }
+    save_blocks_database(previous, blocks_path)
+    blocks_database = load_blocks_database(blocks_path)
+
+    # Blocks of previous file are read only now, after file was written again
+    save_blocks_database(database, blocks_path)
+
+    assert blocks_database["cpic"]["recommendations"]["drug"] == previous["cpic"]["recommendations"]["drug"]
+    assert get_drugs(load_blocks_database(blocks_path)) == get_drugs(database)
@@ -1,4 +1,7 @@
 #!/usr/bin/env python3
+import gzip
+import io
+import mmap
 import os
 
 from openpgx.cpic import *
@@ -260,3 +263,112 @@ def test_yield_rows_from_sql_file():
                             'reference': False,
                             'structuralvariation': False,
                             'version': '1'}]}
+
+
+CPIC_SQL = """COPY cpic.allele (id, genesymbol, name) FROM stdin;
+1	CYP2D6	*1
+\\.
+
+COPY cpic.drug (drugid, name) FROM stdin;
+RxNorm:1	codeine
+\\.
+
+COPY cpic.gene_result (id, genesymbol, result, activityscore) FROM stdin;
+10	CYP2D6	Poor Metabolizer	0.0
+\\.
+
+COPY cpic.gene_result_diplotype (id, functionphenotypeid, diplotype) FROM stdin;
+100	20	*4/*3
+\\.
+
+COPY cpic.gene_result_lookup (id, phenotypeid) FROM stdin;
+20	10
+\\.
+
+COPY cpic.guideline (id, url) FROM stdin;
+30	https://cpicpgx.org/guidelines/guideline-for-codeine-and-cyp2d6/
+\\.
+
+COPY cpic.recommendation (drugid, guidelineid, lookupkey, drugrecommendation, classification) FROM stdin;
+RxNorm:1	30	{"CYP2D6": "0.0"}	Avoid codeine use	Strong
+\\.
+"""
+
+
+def test_yield_projected_rows_from_sql_file():
+    rows = list(
+        yield_projected_rows_from_sql_file(
+            io.StringIO(CPIC_SQL), {"recommendation": ["lookupkey", "drugid"], "gene_result_lookup": ["phenotypeid"]}
+        )
+    )
+
+    assert [table for table, _ in rows] == ["gene_result_lookup", "recommendation"]
+    assert rows[0][1].phenotypeid == "10"
+    assert rows[1][1] == ({"CYP2D6": "== 0.00"}, "RxNorm:1")
+    assert rows[1][1]._fields == ("lookupkey", "drugid")
+
+
+def test_consume_cpic_rows():
+    builders = [CpicRecommendationsBuilder(), CpicEncodingsBuilder()]
+    rows = yield_projected_rows_from_sql_file(io.StringIO(CPIC_SQL), merge_columns(builders))
+
+    recommendations, encodings = consume_cpic_rows(rows, builders)
+
+    assert recommendations == {
+        "codeine": [
+            {
+                "factors": {"CYP2D6": "== 0.00"},
+                "recommendation": "Avoid codeine use",
+                "strength": "strong",
+                "guideline": "https://cpicpgx.org/guidelines/guideline-for-codeine-and-cyp2d6/",
+            }
+        ]
+    }
+    assert encodings == {"CYP2D6": {"*3/*4": ["poor metabolizer", 0.0]}}
+    assert recommendations == create_cpic_recommendations(load_cpic_database_from_descriptor(io.StringIO(CPIC_SQL)))
+
+
+def test_encodings_builder_caches_gene_results():
+    encode_gene_result.cache_clear()
+    builder = CpicEncodingsBuilder()
+    row_types = create_row_types(builder.columns)
+    builder.add("gene_result", row_types["gene_result"]("10", "CYP2D6", "Poor Metabolizer", "0.0"))
+    builder.add("gene_result_lookup", row_types["gene_result_lookup"]("20", "10"))
+    for diplotype in ["*4/*3", "*4/*4", "*5/*6"]:
+        builder.add("gene_result_diplotype", row_types["gene_result_diplotype"](diplotype, "20"))
+
+    assert builder.result() == {
+        "CYP2D6": {
+            "*3/*4": ["poor metabolizer", 0.0],
+            "*4/*4": ["poor metabolizer", 0.0],
+            "*5/*6": ["poor metabolizer", 0.0],
+        }
+    }
+    assert (builder.cache_hits, builder.cache_misses) == (2, 1)
+
+
+def test_find_copy_chunks(tmp_path):
+    sql_path = tmp_path / "cpic.sql"
+    sql_path.write_text(CPIC_SQL)
+
+    with open(sql_path, "rb") as file:
+        buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        chunks = find_copy_chunks(buffer, {"drug": ["name"], "gene_result_diplotype": ["diplotype"]}, chunk_size=1)
+        blocks = [(table, buffer[start:end]) for table, _, start, end in chunks]
+
+    assert blocks == [
+        ("drug", b"RxNorm:1\tcodeine\n"),
+        ("gene_result_diplotype", b"100\t20\t*4/*3\n"),
+    ]
+
+
+def test_build_from_cpic_dump_in_parallel(tmp_path):
+    sql_gz_path = str(tmp_path / "cpic.sql.gz")
+    with gzip.open(sql_gz_path, "wt") as file:
+        file.write(CPIC_SQL)
+
+    sequential = build_from_cpic_dump(sql_gz_path, [CpicRecommendationsBuilder(), CpicEncodingsBuilder()], jobs=1)
+    parallel = build_from_cpic_dump(sql_gz_path, [CpicRecommendationsBuilder(), CpicEncodingsBuilder()], jobs=2)
+
+    assert parallel == sequential
+    assert os.path.exists(tmp_path / "cpic.sql")
@@ -1,9 +1,12 @@
+import json
+import zipfile
+
+import pytest
+
 from openpgx.dpwg import *
 from openpgx.helpers import *
 
-DATA_DIRECTORY = (
-    "../.cache/api.pharmgkb.org/v1/download/file/data/dosingGuidelines.json/"
-)
+DPWG_ARCHIVE = zipfile.ZipFile(download_to_cache_dir(DPWG_DEFAULT_URL, extract=False))
 DATA = create_dpwg_database()
 DPWG_ENCODINGS = DATA["encodings"]
 DPWG_RECOMMENDATIONS = DATA["recommendations"]
@@ -31,12 +34,29 @@ def test_normalize_dpwg_factor():
     assert normalize_dpwg_factor("HLA-B*44") == "*44 positive"
 
 
+@pytest.mark.parametrize("pattern", [None, create_keys_pattern(FACTOR_NORMALIZATION)])
+def test_normalize_dpwg_factor_uses_first_key(pattern, monkeypatch):
+    # The same keys are found with loop and with pattern used for more keys
+    monkeypatch.setattr("openpgx.dpwg.FACTOR_NORMALIZATION_PATTERN", pattern)
+    normalize_dpwg_factor.cache_clear()
+
+    # "Activity Score 1" is before "Activity Score 1.5" and "NM" before "IM" in FACTOR_NORMALIZATION
+    assert normalize_dpwg_factor("DPYD Activity Score 1.5") == "== 1.00"
+    assert normalize_dpwg_factor("CYP2C19 IM or NM") == "normal metabolizer"
+    assert normalize_dpwg_factor("DPD FENO") is None
+    with pytest.raises(Exception, match="Unknown factor"):
+        normalize_dpwg_factor("CYP2D6 unknown")
+
+    normalize_dpwg_factor.cache_clear()
+
+
+def test_create_keys_pattern():
+    assert create_keys_pattern(["PM", "PM1", "UM"]).findall("UM PM1") == ["UM", "PM1"]
+
+
 def test_therapy_table():
-    base_dir = path.join(path.dirname(path.realpath(__file__)), DATA_DIRECTORY)
-    irinotecan = load_json(
-        path.join(
-            base_dir, "Annotation_of_DPWG_Guideline_for_irinotecan_and_UGT1A1.json"
-        )
+    irinotecan = json.loads(
+        DPWG_ARCHIVE.read("Annotation_of_DPWG_Guideline_for_irinotecan_and_UGT1A1.json")
     )
 
     assert get_recommendations_by_factors(
@@ -49,10 +69,8 @@ def test_therapy_table():
         "guided by the neutrophil count.",
     }
     # It should be ampty because "recommendation": false
-    gliclazide = load_json(
-        path.join(
-            base_dir, "Annotation_of_DPWG_Guideline_for_gliclazide_and_CYP2C9.json"
-        )
+    gliclazide = json.loads(
+        DPWG_ARCHIVE.read("Annotation_of_DPWG_Guideline_for_gliclazide_and_CYP2C9.json")
     )
     assert (
         get_recommendations_by_factors(gliclazide["guideline"]["textMarkdown"]["html"])
@@ -66,12 +84,9 @@ def test_message_for_no_recommendations():
 
 
 def test_load_dpwg_entry():
-    base_dir = path.join(path.dirname(path.realpath(__file__)), DATA_DIRECTORY)
     assert (
         load_dpwg_entry(
-            path.join(
-                base_dir, "Annotation_of_DPWG_Guideline_for_ribavirin_and_HLA_B.json"
-            )
+            "Annotation_of_DPWG_Guideline_for_ribavirin_and_HLA_B.json", DPWG_ARCHIVE
         )["recommendations_by_factor"]
         == {}
     )
@@ -191,4 +206,54 @@ def test_check_encodings_for_f5():
 def test_check_encodings_for_vkorc():
     assert DPWG_ENCODINGS["VKORC1"] == {
         'rs9923231 reference (C)': ['rs9923231 reference (C)'],
-     'rs9923231 variant (T)': ['rs9923231 variant (T)']}
\ No newline at end of file
+     'rs9923231 variant (T)': ['rs9923231 variant (T)']}
+
+def test_load_all_dpwg_entries_in_parallel(tmp_path):
+    archive_path = str(tmp_path / "dosingGuidelines.json.zip")
+    with zipfile.ZipFile(archive_path, "w") as archive:
+        for drug in ["warfarin", "codeine", "abacavir", "tramadol", "clopidogrel"]:
+            archive.writestr(
+                f"Annotation_of_DPWG_Guideline_for_{drug}_and_CYP2D6.json",
+                json.dumps(
+                    {
+                        "guideline": {
+                            "@id": f"https://www.pharmgkb.org/guidelineAnnotation/{drug}",
+                            "recommendation": False,
+                            "summaryMarkdown": {"html": f"<p>{drug}</p>"},
+                        }
+                    }
+                ),
+            )
+        archive.writestr("README.pdf", "")
+
+    entries = load_all_dpwg_entries(archive_path, jobs=1)
+
+    assert [entry["drug"] for entry in entries] == ["abacavir", "clopidogrel", "codeine", "tramadol", "warfarin"]
+    assert load_all_dpwg_entries(archive_path, jobs=2) == entries
+
+
+def test_create_dpwg_database_removes_extracted_guidelines(tmp_path, monkeypatch):
+    archive_path = str(tmp_path / "dosingGuidelines.json.zip")
+    with zipfile.ZipFile(archive_path, "w") as archive:
+        archive.writestr(
+            "Annotation_of_DPWG_Guideline_for_codeine_and_CYP2D6.json",
+            json.dumps(
+                {
+                    "guideline": {
+                        "@id": "https://www.pharmgkb.org/guidelineAnnotation/codeine",
+                        "recommendation": False,
+                        "summaryMarkdown": {"html": "<p>codeine</p>"},
+                    }
+                }
+            ),
+        )
+
+    monkeypatch.setattr("openpgx.helpers.repository_path", lambda path: str(tmp_path / path))
+    monkeypatch.setattr("openpgx.dpwg.download_to_cache_dir", lambda url, extract=True: archive_path)
+    # Left by previous versions, which extracted archive
+    extracted_path = tmp_path / ".cache/api.pharmgkb.org/v1/download/file/data/dosingGuidelines.json"
+    extracted_path.mkdir(parents=True)
+    (extracted_path / "Annotation_of_DPWG_Guideline_for_codeine_and_CYP2D6.json").write_text("{}")
+
+    assert create_dpwg_database(jobs=1)["recommendations"]["codeine"]
+    assert not extracted_path.exists()
@@ -1,3 +1,11 @@
+import hashlib
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from threading import Event, Thread
+
+import pytest
+
 from openpgx.dpwg import create_dpwg_database
 from openpgx.helpers import *
 
@@ -69,3 +77,214 @@ def test_extract_usage():
     usage = extract_usage(repository_path("README.md")).split("\n")
     assert usage[0][0:9] == "$ openpgx"
     assert usage[-1] == "https://github.com/monigenomi/openpgx"
+
+
+def test_save_and_yield_jsonl(tmp_path):
+    jsonl_path = str(tmp_path / "genotypes.jsonl")
+    records = [{"CYP2D6": "*7/*7"}, {}, {"HLA-B*57:01": "positive"}]
+
+    save_jsonl(jsonl_path, iter(records))
+
+    assert list(yield_jsonl(jsonl_path)) == records
+
+
+def test_read_database_from_snapshot(tmp_path):
+    database = {
+        source: {"recommendations": {}, "encodings": {"CYP2D6": {"*1/*1": ["normal metabolizer"]}}}
+        for source in ["cpic", "dpwg", "fda"]
+    }
+    database_path = str(tmp_path / "database.json")
+    save_json(database_path, database)
+    save_snapshot(
+        snapshot_path_for(database_path),
+        {**database, "fda": {"recommendations": {}, "encodings": {}}},
+        hash_paths([database_path]),
+    )
+
+    # load_database would make this database the one returned by get_database for following tests
+    loaded = read_database(database_path)
+
+    assert snapshot_path_for(database_path) == str(tmp_path / "database.pickle")
+    assert loaded["fda"]["encodings"] == {}
+    assert loaded["cpic"]["encodings"]["CYP2D6"]["*1/*1"] is loaded["dpwg"]["encodings"]["CYP2D6"]["*1/*1"]
+
+    # Snapshot created from other json is not used, even if it is newer
+    save_json(database_path, {**database, "cpic": {"recommendations": {}, "encodings": {}}})
+    os.utime(database_path, ns=(0, 0))
+    assert read_database(database_path)["cpic"]["encodings"] == {}
+
+    # Snapshot has the same permissions as json, and if it can not be read, json is used
+    assert os.stat(snapshot_path_for(database_path)).st_mode == os.stat(database_path).st_mode
+    with open(snapshot_path_for(database_path), "wb") as f:
+        f.write(b"not a pickle")
+    assert read_database(database_path)["fda"]["encodings"] == database["fda"]["encodings"]
+
+
+def test_intern_strings():
+    data = intern_strings({"a": ["x" * 100, 1.0], "b": ["x" * 100, 1.0], "c": ["x" * 100, 1]})
+
+    assert data["a"] is data["b"]
+    assert data["a"] is not data["c"]
+    assert data["a"][0] is data["c"][0]
+
+
+def test_database_handle_reloads_changed_database(tmp_path):
+    database = {source: {"recommendations": {}, "encodings": {}} for source in ["cpic", "dpwg", "fda"]}
+    database_path = str(tmp_path / "database.json")
+    save_json(database_path, database)
+    handle = DatabaseHandle(database_path, check_interval=0)
+
+    with ThreadPoolExecutor(8) as executor:
+        loaded = list(executor.map(lambda _: handle.get(), range(32)))
+
+    assert all(current is loaded[0] for current in loaded)
+    assert handle.get() is loaded[0]
+
+    database["fda"]["encodings"] = {"CYP2D6": {"*1/*1": ["normal metabolizer"]}}
+    save_json(database_path, database)
+    os.utime(database_path, ns=(0, 0))
+
+    reloaded = handle.get()
+
+    assert reloaded is not loaded[0]
+    assert reloaded["fda"]["encodings"] == database["fda"]["encodings"]
+    assert loaded[0]["fda"]["encodings"] == {}
+
+    os.remove(database_path)
+
+    assert handle.get() is reloaded
+
+
+def test_database_handle_does_not_block_during_reload(tmp_path, monkeypatch):
+    database_path = str(tmp_path / "database.json")
+    save_json(database_path, {source: {"recommendations": {}, "encodings": {}} for source in ["cpic", "dpwg", "fda"]})
+    handle = DatabaseHandle(database_path, check_interval=0)
+    previous = handle.get()
+
+    reading = Event()
+    finish_reading = Event()
+
+    def slow_read_database(database_path):
+        reading.set()
+        finish_reading.wait(5)
+        return {"reloaded": True}
+
+    monkeypatch.setattr("openpgx.helpers.read_database", slow_read_database)
+    os.utime(database_path, ns=(0, 0))
+
+    reloading = Thread(target=handle.get)
+    reloading.start()
+    assert reading.wait(5)
+
+    # Other callers get previous database while it is reloaded
+    assert handle.get() is previous
+
+    finish_reading.set()
+    reloading.join()
+    assert handle.get() == {"reloaded": True}
+
+
+class DownloadHandler(BaseHTTPRequestHandler):
+    data = bytes(range(256)) * 40
+    requests = []
+    interrupt = False
+
+    def do_GET(self):
+        DownloadHandler.requests.append(dict(self.headers))
+
+        if self.headers["If-None-Match"] == '"v1"':
+            self.send_response(304)
+            self.end_headers()
+            return
+
+        start = 0
+        if self.headers["Range"] and self.headers["If-Range"] == '"v1"':
+            start = int(self.headers["Range"][6:-1])
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{len(self.data) - 1}/{len(self.data)}")
+        else:
+            self.send_response(200)
+
+        self.send_header("Content-Length", str(len(self.data) - start))
+        self.send_header("ETag", '"v1"')
+        self.end_headers()
+
+        if DownloadHandler.interrupt:
+            DownloadHandler.interrupt = False
+            self.wfile.write(self.data[start : start + 1000])
+            self.close_connection = True
+        else:
+            self.wfile.write(self.data[start:])
+
+    def log_message(self, *args):
+        pass
+
+
+def test_download_url_resumes_and_revalidates(tmp_path, monkeypatch):
+    server = HTTPServer(("127.0.0.1", 0), DownloadHandler)
+    Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}/data.bin"
+    save_path = str(tmp_path / "data.bin")
+    monkeypatch.setattr("openpgx.helpers.DOWNLOAD_CHUNK_SIZE", 100)
+
+    try:
+        DownloadHandler.interrupt = True
+        with pytest.raises(Exception):
+            download_url(url, save_path)
+
+        assert not os.path.exists(save_path)
+        assert os.path.getsize(save_path + ".part") == 1000
+
+        assert download_url(url, save_path, sha256=hashlib.sha256(DownloadHandler.data).hexdigest())
+        assert DownloadHandler.requests[-1]["Range"] == "bytes=1000-"
+        assert open(save_path, "rb").read() == DownloadHandler.data
+        assert not os.path.exists(save_path + ".part")
+
+        assert not download_url(url, save_path)
+        assert open(save_path, "rb").read() == DownloadHandler.data
+
+        with pytest.raises(Exception):
+            download_url(url, str(tmp_path / "other.bin"), sha256="0" * 64)
+        assert sorted(os.listdir(tmp_path)) == ["data.bin", "data.bin.download.json"]
+    finally:
+        server.shutdown()
+
+
+def test_download_to_cache_dir_extracts_zip_only_if_requested(tmp_path, monkeypatch):
+    def download_url(url, save_path, sha256=None):
+        with zipfile.ZipFile(save_path, "w") as archive:
+            archive.writestr("entry.json", "{}")
+        return True
+
+    monkeypatch.setattr("openpgx.helpers.repository_path", lambda path: str(tmp_path / path))
+    monkeypatch.setattr("openpgx.helpers.download_url", download_url)
+    url = "https://example.com/files/guidelines.zip"
+    extracted_path = tmp_path / ".cache/example.com/files/guidelines"
+
+    assert download_to_cache_dir(url, extract=False) == str(extracted_path) + ".zip"
+    assert not extracted_path.exists()
+
+    assert download_to_cache_dir(url) == str(extracted_path)
+    assert os.listdir(extracted_path) == ["entry.json"]
+
+    assert download_to_cache_dir(url, extract=False) == str(extracted_path) + ".zip"
+    assert os.listdir(extracted_path) == ["entry.json"]
+
+
+def test_first_table_from_html():
+    html = """
+        <p>Dosing</p>
+        <table>
+            <tr><th>Phenotype</th><th>Recommendation</th></tr>
+            <tr><td>PM</td><td>
+                <p>Start with <b>70%</b> of the dose &amp; monitor</p>
+            </td></tr>
+        </table>
+        <table><tr><td>ignored</td></tr></table>
+    """
+
+    assert first_table_from_html(html) == [
+        ["Phenotype", "Recommendation"],
+        ["PM", "\nStart with 70% of the dose & monitor\n"],
+    ]
+    assert first_table_from_html("<p>no table</p>") == []
@@ -46,3 +46,85 @@
 # def test_recommendation_present_no_phenotype():
 #     # There is no recommendation for this phenotype
 #     result = get_all({"HLA-B": "*15:02 allele negative"})
+
+
+from openpgx.helpers import configure_logger, logger, with_logs
+
+
+def test_production_logging_mode():
+    records = []
+
+    try:
+        configure_logger("production", stacktrace=False)
+        logger.add(lambda message: records.append(message.record))
+
+        @with_logs
+        def warn():
+            logger.warning("Allele does not exist in CPIC", gene="CYP2C9")
+            return {}
+
+        assert warn()["warnings"] == [{"message": "Allele does not exist in CPIC", "gene": "CYP2C9"}]
+        assert records[0]["message"] == "Allele does not exist in CPIC"
+        assert "stacktrace" not in records[0]
+
+        configure_logger("production", stacktrace=True)
+        logger.add(lambda message: records.append(message.record))
+        logger.info("Downloading file")
+        assert "stacktrace" in records[-1]
+    finally:
+        configure_logger("development", stacktrace=False)
+
+
+def test_with_logs_in_concurrent_threads():
+    from concurrent.futures import ThreadPoolExecutor
+    from threading import Barrier
+
+    barrier = Barrier(4)
+
+    @with_logs
+    def phenotype(gene):
+        barrier.wait()
+        logger.warning("Phenotype for genotype does not exist in CPIC database", gene=gene)
+        barrier.wait()
+        logger.error("Gene does not exist in any database", gene=gene)
+        return {"gene": gene}
+
+    with ThreadPoolExecutor(4) as executor:
+        results = list(executor.map(phenotype, ["CYP2C9", "CYP2D6", "DPYD", "TPMT"]))
+
+    for result in results:
+        assert [warning["gene"] for warning in result["warnings"]] == [result["gene"]]
+        assert [error["gene"] for error in result["errors"]] == [result["gene"]]
+
+
+def test_nested_with_logs():
+    @with_logs
+    def inner():
+        logger.warning("inner")
+        return {}
+
+    @with_logs
+    def outer():
+        logger.warning("outer")
+        return {"inner": inner()}
+
+    result = outer()
+    assert [warning["message"] for warning in result["inner"]["warnings"]] == ["inner"]
+    assert [warning["message"] for warning in result["warnings"]] == ["outer", "inner"]
+
+
+def test_with_logs_after_handlers_are_removed():
+    @with_logs
+    def warn():
+        logger.warning("Allele does not exist in CPIC", gene="CYP2C9")
+        return {}
+
+    try:
+        # For example application that replaces default sinks of loguru with its own
+        logger.remove()
+        assert warn()["warnings"] == [{"message": "Allele does not exist in CPIC", "gene": "CYP2C9"}]
+
+        logger.configure(handlers=[{"sink": lambda message: None}])
+        assert warn()["warnings"] == [{"message": "Allele does not exist in CPIC", "gene": "CYP2C9"}]
+    finally:
+        configure_logger("development", stacktrace=False)
@@ -1,4 +1,8 @@
+import subprocess
+import sys
+
 from openpgx import *
+from openpgx.index import *
 
 database = get_database()
 
@@ -225,3 +229,129 @@ def test_issue3():
         }]
     
     
+
+
+def test_find_matching_recommendations_same_as_full_scan():
+    encodings = phenotyping({"CYP2D6": "*7/*7", "CYP2C19": "*1/*2", "HLA-B*57:01": "positive"}, database)
+
+    for source in SOURCES:
+        source_database = database[source]
+        expected = [
+            (drug, recommendation)
+            for drug, drug_recommendations in source_database["recommendations"].items()
+            for recommendation in drug_recommendations
+            if recommendation_matches_genotype(recommendation, encodings)
+        ]
+        assert find_matching_recommendations(source_database["index"], encodings) == expected
+
+
+def test_get_recommendations_for_patients():
+    patients = [
+        {"CYP2D6": "*7/*7", "CYP2C19": "*1/*2"},
+        {"HLA-A*31:01": "positive", "HLA-B*15:02": "negative"},
+        {"CYP2C19": "*2/*1", "CYP2D6": "*7/*7"},
+    ]
+    recommendations = get_recommendations_for_patients(patients)
+
+    assert recommendations == [get_recommendations_for_patient(patient) for patient in patients]
+    assert recommendations[0] is recommendations[2]
+
+
+def test_compile_factor():
+    assert type(compile_factor("poor metabolizer")) == EqualsPredicate
+    assert compile_factor(">= 1.50").threshold == 1.5
+    assert compile_factor("== 2.00").matches(2)
+    assert compile_factor("== 2.00").matches("== 2.00")
+    assert not compile_factor(">= 1.50").matches(None)
+    assert compile_factor(">= 1.50") is compile_factor(">= 1.50")
+
+
+def test_yield_recommendations_for_patients_with_jobs():
+    patients = [{"CYP2D6": "*7/*7"}, {"CYP2C19": "*1/*2"}, {}, {"HLA-B*57:01": "positive"}]
+
+    assert list(yield_recommendations_for_patients(patients, chunk_size=1, jobs=2)) == [
+        get_recommendations_for_patient(patient) for patient in patients
+    ]
+
+
+def test_create_phenotypes_lookup():
+    lookup = create_phenotypes_lookup({
+        "cpic": {"encodings": {"CYP2D6": {"*1≥3/*2≥3": ["ultrarapid metabolizer", 6.0], "*1/*2": ["normal metabolizer"]}}},
+        "dpwg": {"encodings": {"CYP2D6": {"*1/*2": ["intermediate metabolizer"], "*2/*1": ["not sorted"]}}},
+    })
+
+    assert lookup == {
+        "CYP2D6": {
+            "*1≥3/*2≥3": ["ultrarapid metabolizer", 6.0],
+            "*2≥3/*1≥3": ["ultrarapid metabolizer", 6.0],
+            "*1/*2": ["intermediate metabolizer"],
+            "*2/*1": ["intermediate metabolizer"],
+        }
+    }
+    assert phenotyping({"CYP2D6": "*2/*1", "FOO": "bar"}, {"phenotypes": lookup}) == {
+        "CYP2D6": ["intermediate metabolizer"], "FOO": []
+    }
+
+
+def test_import_does_not_load_update_dependencies():
+    # Run in new interpreter, because modules are already imported by other tests
+    imported = subprocess.run(
+        [sys.executable, "-c", "import sys, openpgx; print(' '.join(sys.modules))"],
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout.split()
+
+    for module in ["numpy", "loguru", "termcolor", "bs4", "openpgx.cpic", "openpgx.dpwg", "openpgx.fda", "urllib.request"]:
+        assert module not in imported
+
+
+def test_create_source_database_reuses_build(tmp_path, monkeypatch):
+    source_path = tmp_path / "fda.json"
+    source_path.write_text("[]")
+    builds = []
+
+    def create_fda_database(url, jobs):
+        builds.append(url)
+        return {"recommendations": {"drug": [{"factors": {}}]}, "encodings": {}}
+
+    monkeypatch.setattr("openpgx.BUILD_CACHE_DIR", str(tmp_path / "build"))
+    monkeypatch.setattr("openpgx.download_to_cache_dir", lambda url, extract=True: str(source_path))
+    monkeypatch.setattr("openpgx.get_database_builder", lambda name: create_fda_database)
+
+    url = "https://example.com/fda.json"
+    first = create_source_database("fda", url)
+    second = create_source_database("fda", url)
+
+    assert builds == [url]
+    assert second == first
+
+    source_path.write_text("[{}]")
+    create_source_database("fda", url)
+
+    assert len(builds) == 2
+    assert len(list((tmp_path / "build").iterdir())) == 1
+
+
+def test_create_database_builds_sources_concurrently(tmp_path, monkeypatch):
+    source_path = tmp_path / "source.json"
+    source_path.write_text("[]")
+
+    def get_database_builder(name):
+        def create_source(url, jobs):
+            return {"recommendations": {url: []}, "encodings": {"CYP2D6": {"*1/*1": [name]}}}
+
+        return create_source
+
+    monkeypatch.setattr("openpgx.BUILD_CACHE_DIR", str(tmp_path / "build"))
+    monkeypatch.setattr("openpgx.download_to_cache_dir", lambda url, extract=True: str(source_path))
+    monkeypatch.setattr("openpgx.get_database_builder", get_database_builder)
+
+    result = create_database({"cpic": "cpic.sql.gz", "dpwg": "dpwg.zip", "fda": "fda.json"})
+
+    assert [result[source]["recommendations"] for source in SOURCES] == [
+        {"cpic.sql.gz": []},
+        {"dpwg.zip": []},
+        {"fda.json": []},
+    ]
+    assert result["phenotypes"]["CYP2D6"]["*1/*1"] == ["dpwg"]
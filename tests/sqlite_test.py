@@ -0,0 +1,33 @@
+import openpgx
+from openpgx.helpers import get_database
+from openpgx.sqlite import *
+
+database = get_database()
+
+
+def test_sqlite_database(tmp_path):
+    sqlite_path = str(tmp_path / "database.sqlite")
+    save_sqlite_database(database, sqlite_path)
+    connection = sqlite3.connect(sqlite_path)
+
+    for genotypes in [
+        {"CYP2D6": "*7/*7", "CYP2C19": "*1/*2"},
+        {"HLA-A*31:01": "positive", "HLA-B*15:02": "negative"},
+        {"CYP2D6": "*2≥3/*1≥3"},
+        {},
+    ]:
+        encodings = phenotyping(genotypes, connection)
+        assert encodings == openpgx.phenotyping(genotypes, database)
+        assert get_recommendation_for_drug(connection, "cpic", "abacavir", encodings) == (
+            openpgx.get_recommendation_for_drug(database["cpic"], "abacavir", encodings)
+        )
+        assert get_recommendations_for_patient(genotypes, connection) == openpgx.get_recommendations_for_patient(genotypes)
+
+
+def test_get_connection_for_each_file(tmp_path):
+    paths = [str(tmp_path / "first.sqlite"), str(tmp_path / "second.sqlite")]
+    for sqlite_path in paths:
+        save_sqlite_database(database, sqlite_path)
+
+    assert get_connection(paths[0]) is get_connection(paths[0])
+    assert get_connection(paths[1]) is not get_connection(paths[0])
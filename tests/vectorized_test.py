@@ -0,0 +1,24 @@
+from openpgx import get_recommendations_for_patients
+from openpgx.vectorized import *
+
+
+def test_create_encoding_columns():
+    vocabulary, columns = create_encoding_columns(
+        [{"CYP2D6": ["poor metabolizer", 0.0]}, {"CYP2D6": ["normal metabolizer", "normal", 2.0]}, {}]
+    )
+
+    assert vocabulary == {"poor metabolizer": 0, "normal metabolizer": 1, "normal": 2}
+    assert columns["CYP2D6"][0].tolist() == [[0, -1], [1, 2], [-1, -1]]
+    assert columns["CYP2D6"][1][0:2].tolist() == [[0.0], [2.0]]
+
+
+def test_get_recommendations_for_cohort():
+    patients = [
+        {"CYP2D6": "*7/*7", "CYP2C19": "*1/*2"},
+        {"HLA-A*31:01": "positive", "HLA-B*15:02": "negative"},
+        {"DPYD": "c.601A>C/c.2194G>A (*6)"},
+        {"CYP2D6": "*2≥3/*1≥3"},
+        {},
+    ]
+
+    assert get_recommendations_for_cohort(patients) == get_recommendations_for_patients(patients)